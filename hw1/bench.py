@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# benchmark the limerick detector on synthetic corpora built from cmudict
+import argparse
+import sys
+if sys.version_info[0] == 2:
+  from itertools import izip
+else:
+  izip = zip
+import os.path
+import json
+import time
+import random
+import platform
+import resource
+import subprocess
+import shlex
+
+from limerick import LimerickDetector
+from fileio import prepfile
+
+
+scriptdir = os.path.dirname(os.path.abspath(__file__))
+
+
+def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
+  ''' add the switches --arg and --no-arg that set parser.arg to true/false, respectively'''
+  group = parser.add_mutually_exclusive_group()
+  dest = arg if dest is None else dest
+  group.add_argument('--%s' % arg, dest=dest, action='store_true', default=default, help=help)
+  group.add_argument('--no-%s' % arg, dest=dest, action='store_false', default=default, help="See --%s" % arg)
+
+
+def peak_rss_mb():
+  """
+  Return the peak resident set size of this process in megabytes.
+  """
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # linux reports kilobytes, mac os bytes
+  return rss / (1024.0 * 1024.0) if sys.platform == "darwin" else rss / 1024.0
+
+def git_commit():
+  """
+  Return the commit the benchmarked code is at, or None outside a git checkout.
+  """
+  try:
+    with open(os.devnull, 'w') as devnull:
+      return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=scriptdir,
+                                     stderr=devnull).decode('ascii').strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def rate(func, items):
+  """
+  Call func on every item and return the number of calls per second.
+  """
+  start = time.time()
+  for item in items:
+    func(item)
+  elapsed = time.time() - start
+  return len(items) / elapsed if elapsed else float('inf')
+
+
+def _plain(word):
+  return word.isalpha() and all(ord(c) < 128 for c in word)
+
+
+class Corpus(object):
+  """
+  Builds reproducible synthetic poems from the detector's own dictionary:
+  plain lowercase words, grouped by syllable count, and rhyme classes to pick
+  line endings from.
+  """
+
+  def __init__(self, ld, seed):
+    self._ld = ld
+    self._random = random.Random(seed)
+    words = sorted(word for word, count in ld._syllables.items() if _plain(word))
+    self.words = words
+    self._by_syllables = {}
+    for word in words:
+      self._by_syllables.setdefault(ld.num_syllables(word), []).append(word)
+
+  def _filler(self, syllables):
+    """
+    Return words adding up to syllables syllables.
+    """
+    words = []
+    while syllables > 0:
+      count = self._random.randint(1, min(syllables, 3))
+      words.append(self._random.choice(self._by_syllables[count]))
+      syllables -= count
+    return words
+
+  def _line(self, syllables, ending):
+    return " ".join(self._filler(syllables - self._ld.num_syllables(ending)) + [ending])
+
+  def _rhyme_group(self, size, avoid=None):
+    """
+    Return size distinct words that rhyme with each other (and not with avoid).
+    """
+    while True:
+      word = self._random.choice(self._by_syllables[1])
+      partners = [w for w in self._ld.rhyming_words(word)
+                  if _plain(w) and self._ld.num_syllables(w) == 1]
+      if len(partners) >= size - 1 and not (avoid and self._ld.rhymes(word, avoid)):
+        return [word] + self._random.sample(partners, size - 1)
+
+  def limerick(self):
+    a_words = self._rhyme_group(3)
+    b_words = self._rhyme_group(2, avoid=a_words[0])
+    a_syllables = self._random.randint(7, 9)
+    b_syllables = self._random.randint(4, 6)
+    lines = [self._line(a_syllables, a_words[0]), self._line(a_syllables, a_words[1]),
+             self._line(b_syllables, b_words[0]), self._line(b_syllables, b_words[1]),
+             self._line(a_syllables, a_words[2])]
+    return "\n".join(lines)
+
+  def non_limerick(self):
+    lines = [" ".join(self._random.choice(self.words) for i in range(self._random.randint(2, 8)))
+             for j in range(self._random.randint(3, 7))]
+    return "\n".join(lines)
+
+
+def run(args):
+  results = {"commit": git_commit(), "python": platform.python_version(), "index": args.index,
+             "tokenizer": args.tokenizer, "seed": args.seed}
+
+  start = time.time()
+  ld = LimerickDetector(index=args.index, tokenizer=args.tokenizer)
+  # the dictionary is loaded lazily, on first use, unless asked for
+  ld.load()
+  results["load_seconds"] = time.time() - start
+
+  corpus = Corpus(ld, args.seed)
+  sample = random.Random(args.seed)
+  words = [sample.choice(corpus.words) for i in range(args.ops)]
+  pairs = list(izip(words, reversed(words)))
+  oov = ["".join(sample.choice("abcdefghijklmnopqrstuvwxyz") for i in range(sample.randint(3, 10)))
+         for j in range(args.ops)]
+  results["num_syllables_per_sec"] = rate(ld.num_syllables, words)
+  results["num_syllables_oov_per_sec"] = rate(ld.num_syllables, oov)
+  results["rhymes_per_sec"] = rate(lambda pair: ld.rhymes(*pair), pairs)
+
+  limericks = [corpus.limerick() for i in range(args.poems)]
+  non_limericks = [corpus.non_limerick() for i in range(args.poems)]
+  results["limerick_accept_rate"] = sum(map(ld.is_limerick, limericks)) / float(len(limericks))
+  results["limericks_per_sec"] = rate(ld.is_limerick, limericks)
+  results["non_limericks_per_sec"] = rate(ld.is_limerick, non_limericks)
+  results["peak_rss_mb"] = peak_rss_mb()
+  return results
+
+
+def import_times(stderr):
+  """
+  Parse the report python -X importtime writes to stderr into a dict mapping
+  each top-level module to the microseconds spent importing it (including the
+  modules it imports).
+  """
+  times = {}
+  for line in stderr.splitlines():
+    if not line.startswith("import time:") or "cumulative" in line:
+      continue
+    fields = line.split("|")
+    # nested imports are indented under the module that imported them
+    if not fields[2][1:].startswith(" "):
+      times[fields[2].strip()] = int(fields[1])
+  return times
+
+def startup(scripts, runs, stdin=os.devnull):
+  """
+  Time cold starts of each script in scripts, a list of argument lists (a
+  script and its options), run runs times on stdin. Reports the median wall
+  time, and from -X importtime the total import time and the slowest imports.
+  """
+  results = {}
+  baseline = []
+  for i in range(runs):
+    start = time.time()
+    subprocess.check_call([sys.executable, "-c", "pass"])
+    baseline.append(time.time() - start)
+  results["python_ms"] = 1000 * sorted(baseline)[runs // 2]
+  for script in scripts:
+    walls = []
+    for i in range(runs):
+      with open(stdin) as infile:
+        start = time.time()
+        process = subprocess.Popen([sys.executable, "-X", "importtime"] + script, stdin=infile,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stderr = process.communicate()[1].decode('utf8')
+        walls.append(time.time() - start)
+    imports = import_times(stderr)
+    slowest = sorted(imports, key=imports.get, reverse=True)[:5]
+    results[" ".join(script)] = {"wall_ms": 1000 * sorted(walls)[runs // 2],
+                                 "import_ms": sum(imports.values()) / 1000.0,
+                                 "slowest_imports_ms": dict((name, imports[name] / 1000.0) for name in slowest)}
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser(description="benchmark LimerickDetector and write the results as json",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  addonoffarg(parser, 'debug', help="debug mode", default=False)
+  parser.add_argument("--outfile", "-o", nargs='?', type=argparse.FileType('w'), default=sys.stdout, help="output file")
+  parser.add_argument("--index", default=None, help="pronunciation index compiled by cmuindex.py (default: parse cmudict)")
+  parser.add_argument("--tokenizer", choices=["regex", "nltk"], default="regex", help="word splitter used on poem lines")
+  parser.add_argument("--seed", type=int, default=544, help="random seed for the synthetic corpora")
+  parser.add_argument("--ops", type=int, default=20000, help="words and word pairs to time num_syllables and rhymes on")
+  parser.add_argument("--poems", type=int, default=2000, help="poems in each synthetic corpus")
+  parser.add_argument("--startup", nargs='*', default=None, metavar="SCRIPT", help="instead, time cold starts of these commands (a script and its options) on empty input (default: limerick.py, and --help of each hw1 script)")
+  parser.add_argument("--runs", type=int, default=5, help="cold starts to take the median of with --startup")
+
+  try:
+    args = parser.parse_args()
+  except IOError as msg:
+    parser.error(str(msg))
+
+  outfile = prepfile(args.outfile, 'w')
+  if args.startup is not None:
+    scripts = [shlex.split(script) for script in args.startup] or \
+              [[os.path.join(scriptdir, "limerick.py")]] + \
+              [[os.path.join(scriptdir, name), "--help"] for name in
+               ("limerick.py", "limerickclient.py", "limerickd.py", "cmuindex.py", "bench.py")]
+    outfile.write(json.dumps(startup(scripts, args.runs), indent=2, sort_keys=True)+"\n")
+    return
+  outfile.write(json.dumps(run(args), indent=2, sort_keys=True)+"\n")
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# compile the cmu pronouncing dictionary into a compact, memory-mappable index
+import argparse
+import sys
+import codecs
+if sys.version_info[0] == 2:
+  from itertools import izip
+else:
+  izip = zip
+import os.path
+import io
+import mmap
+import struct
+import hashlib
+from array import array
+import re
+
+scriptdir = os.path.dirname(os.path.abspath(__file__))
+
+
+def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
+  ''' add the switches --arg and --no-arg that set parser.arg to true/false, respectively'''
+  group = parser.add_mutually_exclusive_group()
+  dest = arg if dest is None else dest
+  group.add_argument('--%s' % arg, dest=dest, action='store_true', default=default, help=help)
+  group.add_argument('--no-%s' % arg, dest=dest, action='store_false', default=default, help="See --%s" % arg)
+
+
+# Index layout (all integers little-endian uint32 unless noted):
+#   header       magic, phone count, word count, pronunciation count,
+#                phone id count, sha1 of everything after the header
+#   phone table  byte length, then the phone symbols joined by newlines
+#   word offsets word count + 1 offsets into the word blob
+#   word blob    utf-8 words, sorted bytewise so lookups can bisect
+#   word prons   word count + 1 offsets into the pronunciation offsets
+#   pron offsets pronunciation count + 1 offsets into the phone id blob
+#   phone ids    one uint8 per phone, indexing the phone table
+#   syllables    one uint8 per word, its minimum syllable count
+#   suffixes     one uint8 per pronunciation, where its rhyme suffix starts
+#                (NO_VOWEL if it has no vowel)
+MAGIC = b'CMUIDX02'
+NO_VOWEL = 255
+HEADER = struct.Struct('<8sIIII20s')
+# vowel phones carry a stress digit
+_STRESS = re.compile(r"\d")
+
+
+def _encode(word):
+  """
+  Return word as utf-8 bytes.
+  """
+  return word if isinstance(word, bytes) else word.encode('utf8')
+
+def _pack_offsets(values):
+  return struct.pack('<%dI' % len(values), *values)
+
+def read_cmudict(path=None):
+  """
+  Read nltk's cmudict corpus (or a file in the same format at path) into a
+  dict like nltk.corpus.cmudict.dict() returns, except that each
+  pronunciation is a tuple of shared phone strings, which takes a fraction of
+  the memory of a list of separate ones.
+  """
+  if path is None:
+    import nltk
+    stream = nltk.data.find("corpora/cmudict/cmudict").open()
+  else:
+    stream = open(path, 'rb')
+  phones = {}
+  pronunciations = {}
+  with stream:
+    for line in stream:
+      # WORD VARIANT PHONE PHONE ...
+      pieces = line.decode('utf8').split()
+      if pieces:
+        pron = tuple([phones.setdefault(phone, phone) for phone in pieces[2:]])
+        pronunciations.setdefault(pieces[0].lower(), []).append(pron)
+  return pronunciations
+
+def compile_index(pronunciations, fh):
+  """
+  Write pronunciations (a dict mapping words to lists of pronunciations, as
+  returned by nltk.corpus.cmudict.dict()) to the binary file fh.
+  """
+  words = sorted((_encode(word), word) for word in pronunciations)
+  phones = sorted(set(phone for word in pronunciations
+                      for pron in pronunciations[word] for phone in pron))
+  if len(phones) > 256:
+    raise ValueError("too many distinct phones to index: %d" % len(phones))
+  phone_ids = dict((phone, i) for i, phone in enumerate(phones))
+  vowel_ids = set(phone_ids[phone] for phone in phones if _STRESS.search(phone))
+
+  word_offsets = [0]
+  word_prons = [0]
+  pron_offsets = [0]
+  ids = bytearray()
+  syllables = bytearray()
+  suffix_starts = bytearray()
+  for key, word in words:
+    word_offsets.append(word_offsets[-1] + len(key))
+    counts = []
+    for pron in pronunciations[word]:
+      pron_ids = [phone_ids[phone] for phone in pron]
+      ids.extend(pron_ids)
+      pron_offsets.append(len(ids))
+      vowels = [i for i, phone in enumerate(pron_ids) if phone in vowel_ids]
+      counts.append(len(vowels))
+      suffix_starts.append(vowels[0] if vowels and vowels[0] < NO_VOWEL else NO_VOWEL)
+    word_prons.append(len(pron_offsets) - 1)
+    syllables.append(min(min(counts), 255) if counts else 1)
+
+  phone_table = '\n'.join(phones).encode('ascii')
+  body = b''.join([struct.pack('<I', len(phone_table)), phone_table,
+                   _pack_offsets(word_offsets), b''.join(key for key, word in words),
+                   _pack_offsets(word_prons), _pack_offsets(pron_offsets), bytes(ids),
+                   bytes(syllables), bytes(suffix_starts)])
+  fh.write(HEADER.pack(MAGIC, len(phones), len(words), len(pron_offsets) - 1,
+                       len(ids), hashlib.sha1(body).digest()))
+  fh.write(body)
+
+
+def _distinct_suffixes(prons, starts):
+  """
+  Return the distinct rhyme suffixes of prons given where each one starts,
+  or None if none of them has a vowel.
+  """
+  suffixes = []
+  for start, pron in izip(starts, prons):
+    suffix = tuple(pron[start:])
+    if start != NO_VOWEL and suffix not in suffixes:
+      suffixes.append(suffix)
+  return tuple(suffixes) or None
+
+def rhyme_nucleus(suffix):
+  """
+  Return the tail of a rhyme suffix from its last vowel onward. Two suffixes
+  can only be suffixes of one another if they share this tail.
+  """
+  for i in range(len(suffix) - 1, -1, -1):
+    if _STRESS.search(suffix[i]):
+      return suffix[i:]
+  return suffix
+
+
+class CMUIndex(object):
+  """
+  Read-only view of a compiled pronunciation index. Supports the subset of the
+  dict interface LimerickDetector needs; pronunciations are decoded on demand
+  from the memory-mapped file, so opening an index costs almost nothing and the
+  pages are shared between processes forked after it is opened. An index can
+  also be compiled straight into memory with from_pronunciations, as a compact
+  replacement for the dict it was built from.
+  """
+
+  def __init__(self, path=None, data=None):
+    if data is None:
+      with open(path, 'rb') as fh:
+        self._buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+      self._buf = data
+    magic, n_phones, n_words, n_prons, n_ids, digest = HEADER.unpack_from(self._buf, 0)
+    if magic != MAGIC:
+      raise ValueError("%s is not a pronunciation index" % (path or "data"))
+    self.version = codecs.encode(digest, 'hex').decode('ascii')
+    self._len = n_words
+    self._n_prons = n_prons
+
+    pos = HEADER.size
+    table_len, = struct.unpack_from('<I', self._buf, pos)
+    pos += 4
+    self._phones = self._buf[pos:pos + table_len].decode('ascii').split('\n')
+    pos += table_len
+    self._word_offsets = pos
+    pos += 4 * (n_words + 1)
+    self._words = pos
+    pos += self._offset(self._word_offsets, n_words)
+    self._word_prons = pos
+    pos += 4 * (n_words + 1)
+    self._pron_offsets = pos
+    pos += 4 * (n_prons + 1)
+    self._ids = pos
+    pos += n_ids
+    self._syllables = pos
+    pos += n_words
+    self._suffix_starts = pos
+
+    self.syllables = _Column(self, self._syllable_count, self._scan_syllables)
+    self.suffixes = _Column(self, self._suffixes, self._scan_suffixes)
+
+  @classmethod
+  def from_pronunciations(cls, pronunciations):
+    """
+    Compile pronunciations into an index held in memory rather than in a file.
+    """
+    buf = io.BytesIO()
+    compile_index(pronunciations, buf)
+    return _MemoryIndex(data=buf.getvalue())
+
+  def _offset(self, section, i):
+    return struct.unpack_from('<I', self._buf, section + 4 * i)[0]
+
+  def _key(self, i):
+    start, end = struct.unpack_from('<II', self._buf, self._word_offsets + 4 * i)
+    return self._buf[self._words + start:self._words + end]
+
+  def _find(self, word):
+    """
+    Return the position of word in the sorted word list, or -1.
+    """
+    key = _encode(word)
+    lo, hi = 0, self._len
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self._key(mid) < key:
+        lo = mid + 1
+      else:
+        hi = mid
+    if lo < self._len and self._key(lo) == key:
+      return lo
+    return -1
+
+  def _prons(self, i):
+    first, last = struct.unpack_from('<II', self._buf, self._word_prons + 4 * i)
+    offsets = struct.unpack_from('<%dI' % (last - first + 1), self._buf, self._pron_offsets + 4 * first)
+    ids = bytearray(self._buf[self._ids + offsets[0]:self._ids + offsets[-1]])
+    base = offsets[0]
+    return [[self._phones[p] for p in ids[start - base:end - base]]
+            for start, end in izip(offsets, offsets[1:])]
+
+  def _syllable_count(self, i):
+    return bytearray(self._buf[self._syllables + i:self._syllables + i + 1])[0]
+
+  def _suffixes(self, i):
+    """
+    Return the distinct rhyme suffixes of the word at position i, or None.
+    """
+    first, last = struct.unpack_from('<II', self._buf, self._word_prons + 4 * i)
+    starts = bytearray(self._buf[self._suffix_starts + first:self._suffix_starts + last])
+    return _distinct_suffixes(self._prons(i), starts)
+
+  def _walk(self):
+    """
+    Yield (word, index of its first pronunciation, pronunciations) for every
+    word, decoding each section in bulk rather than bisecting per word.
+    """
+    n = self._len
+    word_offsets = struct.unpack_from('<%dI' % (n + 1), self._buf, self._word_offsets)
+    word_prons = struct.unpack_from('<%dI' % (n + 1), self._buf, self._word_prons)
+    pron_offsets = struct.unpack_from('<%dI' % (word_prons[-1] + 1), self._buf, self._pron_offsets)
+    words = self._buf[self._words:self._words + word_offsets[-1]]
+    ids = bytearray(self._buf[self._ids:self._ids + pron_offsets[-1]])
+    phones = self._phones
+    for i in range(n):
+      first = word_prons[i]
+      prons = [[phones[p] for p in ids[pron_offsets[j]:pron_offsets[j + 1]]]
+               for j in range(first, word_prons[i + 1])]
+      yield words[word_offsets[i]:word_offsets[i + 1]].decode('utf8'), first, prons
+
+  def _scan_syllables(self):
+    counts = bytearray(self._buf[self._syllables:self._syllables + self._len])
+    for i, (word, first, prons) in enumerate(self._walk()):
+      yield word, counts[i]
+
+  def _scan_suffixes(self):
+    starts = bytearray(self._buf[self._suffix_starts:self._suffix_starts + self._n_prons])
+    for word, first, prons in self._walk():
+      suffixes = _distinct_suffixes(prons, starts[first:first + len(prons)])
+      if suffixes:
+        yield word, suffixes
+
+  def items(self):
+    for word, first, prons in self._walk():
+      yield word, prons
+
+  def get(self, word, default=None):
+    i = self._find(word)
+    return default if i < 0 else self._prons(i)
+
+  def __getitem__(self, word):
+    i = self._find(word)
+    if i < 0:
+      raise KeyError(word)
+    return self._prons(i)
+
+  def __contains__(self, word):
+    return self._find(word) >= 0
+
+  def __len__(self):
+    return self._len
+
+  def __iter__(self):
+    for i in range(self._len):
+      yield self._key(i).decode('utf8')
+
+  def keys(self):
+    return list(self)
+
+  def close(self):
+    if isinstance(self._buf, mmap.mmap):
+      self._buf.close()
+
+
+class _MemoryIndex(CMUIndex):
+  """
+  A CMUIndex compiled in memory, which has no start-up cost to keep down:
+  words are found through a dict instead of by bisection, and each
+  pronunciation's rhyme suffix is decoded once, into a tuple shared by every
+  pronunciation with that suffix, so lookups cost little more than in a dict.
+  """
+
+  def __init__(self, path=None, data=None):
+    CMUIndex.__init__(self, path, data)
+    n = self._len
+    word_offsets = struct.unpack_from('<%dI' % (n + 1), self._buf, self._word_offsets)
+    words = self._buf[self._words:self._words + word_offsets[-1]]
+    self._positions = dict((words[start:end].decode('utf8'), i)
+                           for i, (start, end) in enumerate(izip(word_offsets, word_offsets[1:])))
+    self._word_pron_list = array('I', struct.unpack_from('<%dI' % (n + 1), self._buf, self._word_prons))
+    self._syllable_counts = bytearray(self._buf[self._syllables:self._syllables + n])
+    self._pron_suffixes = self._decode_suffixes()
+    self.syllables = _MemoryColumn(self._positions, self._syllable_counts.__getitem__, self._scan_syllables)
+    self.suffixes = _MemoryColumn(self._positions, self._suffixes, self._scan_suffixes)
+
+  def _decode_suffixes(self):
+    offsets = struct.unpack_from('<%dI' % (self._n_prons + 1), self._buf, self._pron_offsets)
+    ids = bytearray(self._buf[self._ids:self._ids + offsets[-1]])
+    starts = bytearray(self._buf[self._suffix_starts:self._suffix_starts + self._n_prons])
+    phones = self._phones
+    interned = {}
+    suffixes = []
+    for j, start in enumerate(starts):
+      if start == NO_VOWEL:
+        suffixes.append(None)
+        continue
+      suffix = tuple([phones[p] for p in ids[offsets[j] + start:offsets[j + 1]]])
+      suffixes.append(interned.setdefault(suffix, suffix))
+    return suffixes
+
+  def _find(self, word):
+    if isinstance(word, bytes):
+      word = word.decode('utf8')
+    return self._positions.get(word, -1)
+
+  def _syllable_count(self, i):
+    return self._syllable_counts[i]
+
+  def _suffixes(self, i):
+    suffixes = []
+    for suffix in self._pron_suffixes[self._word_pron_list[i]:self._word_pron_list[i + 1]]:
+      if suffix is not None and suffix not in suffixes:
+        suffixes.append(suffix)
+    return tuple(suffixes) or None
+
+
+class _Column(object):
+  """
+  Per-word derived table of a CMUIndex, looked up like a dict.
+  """
+
+  def __init__(self, index, read, scan):
+    self._index = index
+    self._read = read
+    self._scan = scan
+
+  def items(self):
+    """
+    Iterate over (word, value) for every word that has a value.
+    """
+    return self._scan()
+
+  def get(self, word, default=None):
+    i = self._index._find(word)
+    if i < 0:
+      return default
+    value = self._read(i)
+    return default if value is None else value
+
+
+
+class _MemoryColumn(_Column):
+  """
+  Per-word derived table of a _MemoryIndex, found through its dict of words.
+  """
+
+  def __init__(self, positions, read, scan):
+    self._positions = positions
+    self._read = read
+    self._scan = scan
+
+  def get(self, word, default=None):
+    i = self._positions.get(word)
+    if i is None and isinstance(word, bytes):
+      i = self._positions.get(word.decode('utf8'))
+    if i is None:
+      return default
+    value = self._read(i)
+    return default if value is None else value
+
+
+def main():
+  parser = argparse.ArgumentParser(description="compile the cmu pronouncing dictionary into an index that LimerickDetector can memory-map",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  addonoffarg(parser, 'debug', help="debug mode", default=False)
+  parser.add_argument("--outfile", "-o", type=argparse.FileType('wb'), default=os.path.join(scriptdir, "cmudict.idx"), help="output index file")
+
+  try:
+    args = parser.parse_args()
+  except IOError as msg:
+    parser.error(str(msg))
+
+  pronunciations = read_cmudict()
+  compile_index(pronunciations, args.outfile)
+  args.outfile.close()
+  if args.debug:
+    sys.stderr.write("indexed {} words into {}\n".format(len(pronunciations), args.outfile.name))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1 @@
+../nlp_cmd_exercise/fileio.py
\ No newline at end of file
@@ -1,46 +1,41 @@
 #!/usr/bin/env python
 import argparse
 import sys
-import codecs
 if sys.version_info[0] == 2:
   from itertools import izip
 else:
   izip = zip
 from collections import defaultdict as dd
+from collections import deque, OrderedDict
+from itertools import islice, chain
+from array import array
 import re
 import os.path
-import gzip
-import tempfile
-import shutil
+import json
+import time
 import atexit
 # Use word_tokenize to split raw text into words
 from string import punctuation
 
-import nltk
-from nltk.tokenize import word_tokenize
-
+from cmuindex import CMUIndex, read_cmudict, rhyme_nucleus
+from fileio import prepfile
 
 
 scriptdir = os.path.dirname(os.path.abspath(__file__))
 
+# works on both byte and unicode strings, unlike str.translate
+_PUNCTUATION = re.compile("[%s]" % re.escape(punctuation))
+# used by guess_syllables; common dipthongs, obviously there are more
+_VOWELS = re.compile("[aeiou]")
+_DIPTHONGS = tuple(set(["au", "oi", "ou", "ai", "ei", "oa", "oe", "io" "ea",
+                        "eu", "aa", "ee", "oo"]))
+# how many guessed syllable counts of out-of-vocabulary words to remember
+OOV_CACHE_SIZE = 10000
+# punctuation is stripped before tokenizing, so words are just runs of word characters
+_WORD = re.compile(r"\w+", re.UNICODE)
+# a detector's pronunciation tables, loaded the first time one of them is used
+_DICTIONARY_TABLES = ("_pronunciations", "_syllables", "_suffixes")
 
-reader = codecs.getreader('utf8')
-writer = codecs.getwriter('utf8')
-
-
-def prepfile(fh, code):
-  if type(fh) is str:
-    fh = open(fh, code)
-  ret = gzip.open(fh.name, code if code.endswith("t") else code+"t") if fh.name.endswith(".gz") else fh
-  if sys.version_info[0] == 2:
-    if code.startswith('r'):
-      ret = reader(fh)
-    elif code.startswith('w'):
-      ret = writer(fh)
-    else:
-      sys.stderr.write("I didn't understand code "+code+"\n")
-      sys.exit(1)
-  return ret
 
 def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
   ''' add the switches --arg and --no-arg that set parser.arg to true/false, respectively'''
@@ -51,33 +46,249 @@ def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
 
 
 
+class LRUCache(object):
+  """
+  A dict of at most maxsize items that forgets the least recently used one when
+  full, counting hits and misses.
+  """
+
+  def __init__(self, maxsize):
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self._data = OrderedDict()
+
+  def get(self, key):
+    """
+    Return the value stored for key, or None.
+    """
+    value = self._data.pop(key, None)
+    if value is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self._data[key] = value
+    return value
+
+  def put(self, key, value):
+    self._data.pop(key, None)
+    if len(self._data) >= self.maxsize:
+      self._data.popitem(last=False)
+    self._data[key] = value
+
+  def __len__(self):
+    return len(self._data)
+
+
+def _suffixes_rhyme(a_suffixes, b_suffixes):
+  """
+  Return True if any suffix in a_suffixes ends with any suffix in b_suffixes,
+  or vice versa. Suffixes are never empty since each starts at a vowel.
+  """
+  for suffix_a in a_suffixes:
+    for suffix_b in b_suffixes:
+      if len(suffix_a) > len(suffix_b):
+        if suffix_a[-len(suffix_b):] == suffix_b: return True
+      elif suffix_b[-len(suffix_a):] == suffix_a: return True
+  return False
+
+
+def _scheme_label(number):
+  """
+  Return the rhyme scheme letter for a class number: A to Z, then AA, AB, ...
+  """
+  label = ""
+  number += 1
+  while number:
+    number, letter = divmod(number - 1, 26)
+    label = chr(ord("A") + letter) + label
+  return label
+
+
+class _LineRecord(object):
+  """
+  One normalized poem line. Its words, syllable count, and the rhyme suffixes
+  of its terminal word are worked out on first use and then kept, so each
+  line is tokenized at most once however many rules look at it.
+  """
+  __slots__ = ('text', '_ld', '_words', '_syllables', '_suffixes')
+
+  def __init__(self, ld, text):
+    self.text = text
+    self._ld = ld
+    self._words = None
+    self._syllables = None
+    self._suffixes = None
+
+  @property
+  def words(self):
+    if self._words is None:
+      self._words = self._ld._tokenize(self.text)
+    return self._words
+
+  @property
+  def syllables(self):
+    if self._syllables is None:
+      self._syllables = sum([self._ld.num_syllables(word) for word in self.words])
+    return self._syllables
+
+  @property
+  def suffixes(self):
+    if self._suffixes is None:
+      words = self.words
+      self._suffixes = self._ld._suffixes.get(words[-1].lower(), ()) if words else ()
+    return self._suffixes
+
+
+class Constraint(object):
+  """
+  One limerick rule. check(ld, a_lines, b_lines) is given the detector and the
+  _LineRecords of the A and B lines and returns True if the poem passes. Rules
+  run in order of cost, so cheap ones can reject a poem before expensive ones
+  are looked at.
+  """
+
+  def __init__(self, name, cost, check):
+    self.name = name
+    self.cost = cost
+    self.check = check
+
+  def __repr__(self):
+    return "Constraint(%r, %r)" % (self.name, self.cost)
+
+
+def _syllables(lines):
+  return [line.syllables for line in lines]
+
+# Rhyme rules only look up each line's terminal word, so they are cheaper than
+# syllable rules, which look up every word. The line count must come first:
+# the other rules assume three A lines and two B lines.
+LIMERICK_RULES = [
+  Constraint("line_count", 0, lambda ld, a, b: len(a) == 3 and len(b) == 2),
+  # No line should have fewer than 4 syllables (checked over each group of lines)
+  Constraint("min_syllables", 2, lambda ld, a, b: sum(_syllables(a)) >= 4 and sum(_syllables(b)) >= 4),
+  # No two A lines should differ in their number of syllables by more than two
+  Constraint("a_spread", 2, lambda ld, a, b: max(_syllables(a)) - min(_syllables(a)) <= 2),
+  # The B lines should differ in their number of syllables by no more than two
+  Constraint("b_spread", 2, lambda ld, a, b: abs(b[0].syllables - b[1].syllables) <= 2),
+  # Each of the B lines should have fewer syllables than each of the A lines
+  Constraint("b_shorter", 2, lambda ld, a, b: min(_syllables(a)) > max(_syllables(b))),
+  # All A lines must rhyme with each other
+  Constraint("a_rhyme", 1, lambda ld, a, b: ld._lines_do_rhyme(a)),
+  # All B lines must rhyme with each other
+  Constraint("b_rhyme", 1, lambda ld, a, b: ld._lines_do_rhyme(b)),
+  # A lines and B lines must not rhyme with each other
+  Constraint("ab_distinct", 1, lambda ld, a, b: not ld._lines_do_rhyme([a[0], b[0]])),
+]
+# the rules syllable_mask evaluates over a whole batch
+SYLLABLE_RULES = ("min_syllables", "a_spread", "b_spread", "b_shorter")
+# the rules syllable_mask relies on, which are_limericks checks poem by poem before it
+MASK_PREREQUISITES = ("line_count",)
+
+
+def syllable_mask(counts):
+  """
+  Given an (N, 5) array of per-line syllable counts, one row per poem with its
+  lines in AABBA order, return a boolean array that is True for the poems that
+  pass every rule in SYLLABLE_RULES. Needs numpy.
+  """
+  import numpy as np
+  counts = np.asarray(counts, dtype=int)
+  if counts.size == 0:
+    return np.zeros(0, dtype=bool)
+  if counts.ndim != 2 or counts.shape[1] != 5:
+    raise ValueError("expected an (N, 5) array of syllable counts, got shape %s" % (counts.shape,))
+  a = counts[:, [0, 1, 4]]
+  b = counts[:, [2, 3]]
+  return ((a.sum(axis=1) >= 4) & (b.sum(axis=1) >= 4)
+          & (a.max(axis=1) - a.min(axis=1) <= 2)
+          & (np.abs(b[:, 0] - b[:, 1]) <= 2)
+          & (a[:, :, np.newaxis] > b[:, np.newaxis, :]).all(axis=(1, 2)))
+
+
 class LimerickDetector:
 
-    def __init__(self):
+    # the rhyme test, looked up on the detector so that a profiler can time it
+    _suffixes_rhyme = staticmethod(_suffixes_rhyme)
+
+    def __init__(self, index=None, tokenizer="regex", rules=None, guess_oov=True, cache=None):
         """
-        Initializes the object to have a pronunciation dictionary available
+        Initializes the object to have a pronunciation dictionary available,
+        loaded when first needed (or by load()). If index names a file
+        compiled by cmuindex.py, memory-map it instead of parsing the cmudict
+        corpus. tokenizer is "regex" (a precompiled word splitter) or "nltk"
+        (nltk's word_tokenize). rules is a list of Constraints a limerick must
+        pass (default: LIMERICK_RULES). If guess_oov, num_syllables guesses
+        words missing from the dictionary and keeps the last OOV_CACHE_SIZE
+        guesses in oov_cache. cache is a ResultCache (or the path of one) that
+        keeps verdicts between runs.
         """
-        self._pronunciations = nltk.corpus.cmudict.dict()
-
+        if isinstance(cache, str):
+          from resultcache import ResultCache
+          cache = ResultCache(cache)
+        self.cache = cache
+        self._cache_prefix = None
+        self._config = "tokenizer=%s guess_oov=%s" % (tokenizer, guess_oov)
+        self.oov_cache = LRUCache(OOV_CACHE_SIZE) if guess_oov else None
+        self._rules = sorted(LIMERICK_RULES if rules is None else rules, key=lambda rule: rule.cost)
+        if tokenizer == "regex":
+          self._tokenize = _WORD.findall
+        elif tokenizer == "nltk":
+          # nltk takes longer to import than most jobs take to run, so only load it when asked for
+          from nltk.tokenize import word_tokenize
+          self._tokenize = word_tokenize
+        else:
+          raise ValueError("unknown tokenizer: %s" % tokenizer)
+        # the dictionary is loaded by load(), on first use
+        self._index = index
+        # built on first use by rhyming_words
+        self._rhyme_words = None
+        self._rhyme_classes = None
+        # the active Profiler, if any (see profile())
+        self._profiler = None
+
+
+    def __getattr__(self, name):
+        # only called for attributes that aren't set, so once the dictionary
+        # is loaded its tables are looked up as plain attributes
+        if name in _DICTIONARY_TABLES:
+          self.load()
+          return getattr(self, name)
+        raise AttributeError(name)
+
+    def load(self):
+        """
+        Loads the pronunciation dictionary now rather than when it is first
+        needed, e.g. before forking workers that should share it.
+        """
+        if "_pronunciations" in self.__dict__:
+          return
+        if self._index:
+          self._pronunciations = CMUIndex(self._index)
+        else:
+          # keep the pronunciations only in compact form, one uint8 per phone
+          # in a single buffer, rather than as lists of strings
+          self._pronunciations = CMUIndex.from_pronunciations(read_cmudict())
+        self._syllables = self._pronunciations.syllables
+        self._suffixes = self._pronunciations.suffixes
 
     def num_syllables(self, word):
         """
         Returns the number of syllables in a word.  If there's more than one
         pronunciation, take the shorter one.  If there is no entry in the
-        dictionary, return 1.
+        dictionary, guess (at least 1) with guess_syllables, or return 1 if
+        the detector was built with guess_oov=False.
         """
-        pron_list = self._pronunciations.get(word)
-        if not pron_list:
+        count = self._syllables.get(word)
+        if count is not None:
+          return count
+        if self.oov_cache is None:
           return 1
-        count_list = []
-        count = 0
-        for pron in pron_list:
-          for letter_set in pron:
-            if re.findall("\d+", letter_set):
-              count += 1
-          count_list.append(count)
-          count = 0
-        return min(count_list)
+        count = self.oov_cache.get(word)
+        if count is None:
+          count = max(1, self.guess_syllables(word))
+          self.oov_cache.put(word, count)
+        return count
 
     def _get_suffix_list(self, word):
       """
@@ -85,115 +296,197 @@ class LimerickDetector:
       pronounciation, where applicable. If initial sounds is a vowel sound, do not modify the 
       pronounciation list.
       """
-      pron_list = self._pronunciations.get(word)
-      suffix_list = []
-      if pron_list:
-        for pron in pron_list:
-          # Keep looping until we find the first instance of a non-consonant sound
-          # E.g. pron = [u'S', u'L', u'AY1', u'T', u'IH0', u'D']
-          # E.g. should return [u'AY1', u'T', u'IH0', u'D']
-          i = 0
-          while (i < len(pron)):
-            if re.findall("\d+", pron[i]):
-              suffix_list.append(pron[i:])
-              break
-            i += 1
-          # else:
-          #   suffix_list.append(pron)
-      return suffix_list
+      # E.g. pron = [u'S', u'L', u'AY1', u'T', u'IH0', u'D']
+      # E.g. should return [u'AY1', u'T', u'IH0', u'D']
+      return [list(suffix) for suffix in self._suffixes.get(word, ())]
     
-    def _is_suffix(self, suffix_a, suffix_b):
-      """
-      Return True if either suffix_a is a suffix of suffix_b, vice versa, or the two 
-      suffixes are the same. Return False otherwise.
-      """
-      is_suffix = False
-      if len(suffix_a) == 0 or len(suffix_b) == 0: is_suffix = False
-      elif suffix_a == suffix_b: is_suffix = True
-      elif len(suffix_a) > len(suffix_b):
-        is_suffix = suffix_b == suffix_a[len(suffix_a) - len(suffix_b):]
-      else:
-        is_suffix = suffix_a == suffix_b[len(suffix_b) - len(suffix_a):]
-      return is_suffix
-
     def rhymes(self, a, b):
         """
         Returns True if two words (represented as lower-case strings) rhyme,
         False otherwise.
         """
-        a_suffix_list = self._get_suffix_list(a.lower())
-        b_suffix_list = self._get_suffix_list(b.lower())
-        for suffix_a in a_suffix_list:
-          for suffix_b in b_suffix_list:
-            if self._is_suffix(suffix_a, suffix_b):
-                return True
-        return False
+        return self._suffixes_rhyme(self._suffixes.get(a.lower(), ()),
+                                    self._suffixes.get(b.lower(), ()))
+
+    def _build_rhyme_index(self):
+      """
+      Index every word by the rhyme nuclei of its suffixes. Words can only rhyme
+      if they share a nucleus, so the words filed under a nucleus are the only
+      candidates that need a full suffix comparison.
+      """
+      words = []
+      classes = dd(lambda: array('I'))
+      for word, suffixes in self._suffixes.items():
+        for nucleus in set(rhyme_nucleus(suffix) for suffix in suffixes):
+          classes[nucleus].append(len(words))
+        words.append(word)
+      self._rhyme_words = words
+      self._rhyme_classes = dict(classes)
+
+    def rhyming_words(self, word, limit=None):
+      """
+      Returns the sorted list of dictionary words that rhyme with word (other
+      than word itself), at most limit of them if limit is given.
+      """
+      word = word.lower()
+      suffixes = self._suffixes.get(word)
+      if not suffixes:
+        return []
+      if self._rhyme_classes is None:
+        self._build_rhyme_index()
+      candidates = set()
+      for nucleus in set(rhyme_nucleus(suffix) for suffix in suffixes):
+        candidates.update(self._rhyme_classes.get(nucleus, ()))
+      found = sorted(w for w in (self._rhyme_words[i] for i in candidates)
+                     if w != word and _suffixes_rhyme(suffixes, self._suffixes.get(w)))
+      return found if limit is None else found[:limit]
+
+    def _rhyme_keys(self, words):
+      """
+      Return the index of each word's rhyme key in a list of the distinct keys,
+      and that list. A key is the set of a word's suffixes, so words that end
+      alike share one and are compared once.
+      """
+      keys = []
+      index = {}
+      ids = []
+      for word in words:
+        key = frozenset(self._suffixes.get(word.lower(), ()))
+        if key not in index:
+          index[key] = len(keys)
+          keys.append(key)
+        ids.append(index[key])
+      return ids, keys
+
+    def _key_rhymes(self, keys):
+      """
+      Return, for each of keys, the set of indices of the keys it rhymes with
+      (itself included, unless it is empty). Keys are filed by rhyme nucleus as
+      they are seen and only compared with earlier keys sharing a nucleus.
+      """
+      filed = dd(list)
+      matches = [set() for key in keys]
+      for i, key in enumerate(keys):
+        candidates = set()
+        for nucleus in set(rhyme_nucleus(suffix) for suffix in key):
+          candidates.update(filed[nucleus])
+          filed[nucleus].append(i)
+        for j in candidates:
+          if _suffixes_rhyme(key, keys[j]):
+            matches[i].add(j)
+            matches[j].add(i)
+        if key:
+          matches[i].add(i)
+      return matches
+
+    def rhymes_many(self, words):
+      """
+      Returns the N x N matrix (a list of lists) whose [i][j] entry is
+      self.rhymes(words[i], words[j]), looking each word up once.
+      """
+      ids, keys = self._rhyme_keys(words)
+      matches = self._key_rhymes(keys)
+      return [[j in matches[i] for j in ids] for i in ids]
+
+    def _rhyme_labels(self, words):
+      """
+      Number the rhyme class of each of words: a word joins the earliest class
+      holding a word it rhymes with, or starts a new one. Words missing from
+      the dictionary each start their own.
+      """
+      ids, keys = self._rhyme_keys(words)
+      matches = self._key_rhymes(keys)
+      classes = {}
+      labels = []
+      count = 0
+      for i in ids:
+        if i not in classes:
+          found = [classes[j] for j in matches[i] if j in classes]
+          if found:
+            classes[i] = min(found)
+          else:
+            classes[i] = count
+            count += 1
+          if not keys[i]:
+            # unknown words rhyme with nothing, so don't file them under a shared key
+            labels.append(classes.pop(i))
+            continue
+        labels.append(classes[i])
+      return labels
+
+    def rhyme_classes(self, words):
+      """
+      Returns lists of the indices of words in the same rhyme class (see
+      rhyme_scheme), in order of each class's first word.
+      """
+      groups = dd(list)
+      for i, label in enumerate(self._rhyme_labels(words)):
+        groups[label].append(i)
+      return [groups[label] for label in sorted(groups)]
+
+    def rhyme_scheme(self, text):
+      """
+      Returns the rhyme scheme of the non-empty lines of text as a list of
+      labels, "A" for the first rhyme class, then "B" and so on ("AA" after
+      "Z"); "".join(ld.rhyme_scheme(limerick)) is "AABBA". A line's class is
+      the earliest one holding a line whose last word rhymes with its own.
+      Each distinct ending is compared only with earlier endings that share a
+      rhyme nucleus, so long poems take close to linear time.
+      """
+      endings = []
+      for line in text.split('\n'):
+        if line.strip():
+          words = self._tokenize(self._normalize_line(line))
+          endings.append(words[-1] if words else "")
+      return [_scheme_label(label) for label in self._rhyme_labels(endings)]
 
     def _get_lines(self, text):
       """
       Split the text into A lines and B lines and return the resulting lists as tuple.
       """
       lines = text.split('\n')
-      lines = [line.lower() for line in lines if line.strip()] # ignore any empty lines
+      lines = [self._normalize_line(line) for line in lines if line.strip()] # ignore any empty lines
       a_lines = []
       b_lines = []
       for index, line in enumerate(lines):
-        line = " ".join([l for l in line.split(" ") if l]) # Remove any flanking spaces
         if index in [0, 1, 4]:
           a_lines.append(line)
         else:
           b_lines.append(line)
-      a_lines =[self._remove_punctuations(line) for line in a_lines]
-      b_lines =[self._remove_punctuations(line) for line in b_lines]
       return a_lines, b_lines
 
-    def _is_valid_diff(self, a_num_syllables, b_num_syllables):
+    def _normalize_line(self, line):
       """
-      Return True if the inter-line syllable count difference conforms to the 
-      assignment specification. Return False otherwise.
+      Lowercase line, remove any flanking spaces and its punctuation.
       """
-      # The syllable count difference between the B lines must not be greater than 2
-      if abs(b_num_syllables[0] - b_num_syllables[1]) > 2: return False 
+      line = " ".join([l for l in line.lower().split(" ") if l])
+      return self._remove_punctuations(line)
 
-      # The syllable count difference between any of the A lines must not be greater
-      # than 2
-      for i in range(len(a_num_syllables)):
-        for j in range(len(a_num_syllables)):
-          if abs(a_num_syllables[i] - a_num_syllables[j]) > 2: return False
-
-      # Each of the B lines should have fewer syllables than the A lines
-      for i in range(len(a_num_syllables)):
-        for j in range(len(b_num_syllables)):
-           if a_num_syllables[i] - b_num_syllables[j] <= 0: return False
-      return True
-      
+    def _analyze_line(self, line):
+      """
+      Return a _LineRecord for a normalized line, which works out what the
+      limerick rules need to know about it as they ask.
+      """
+      return _LineRecord(self, line)
 
     def _lines_do_rhyme(self, lines):
       """
-      Return True if all the lines rhyme with each other. Return False otherwise.
+      Return True if all the lines (_LineRecords) rhyme with each other. Return False otherwise.
       """
+      # Every line is compared against the last one, which rhymes with itself
+      # whenever it is in the dictionary, so at least one other line has to match
+      last = lines[-1].suffixes
+      rhyme = self._suffixes_rhyme
       count = 0
-      do_rhyme = False
-      for i in range(len(lines)):
-        for j in range(len(lines)):
-          i_terminal_word = word_tokenize(lines[i])[-1]
-          j_terminal_word = word_tokenize(lines[j])[-1]
-          do_rhyme = self.rhymes(i_terminal_word, j_terminal_word)
-        if do_rhyme: count += 1
-      do_rhyme = True if count >= 2 else False
-      return do_rhyme
+      for line in lines:
+        if rhyme(line.suffixes, last): count += 1
+      return count >= 2
     
-    def _line_num_syllables(self, line):
-      """
-      Return the number of syllables in line.
-      """
-      return sum([self.num_syllables(word) for word in word_tokenize(line)])
-
     def _remove_punctuations(self, raw):
       """
       Remove punctuations from raw text.
       """
-      return raw.translate(None, punctuation)
+      return _PUNCTUATION.sub("", raw)
 
 
     def is_limerick(self, text):
@@ -215,31 +508,84 @@ class LimerickDetector:
         (English professors may disagree with this definition, but that's what
         we're using here.)
         """
-        # Check if the text should be considered as a limerick to begin with
+        return self.rejected_by(text) is None
+
+    def profile(self):
+        """
+        Returns a profiler.Profiler for this detector, to use as a context
+        manager: while inside it, calls to the hot methods and rules are
+        counted and timed. Outside it the detector runs uninstrumented.
+        """
+        from profiler import Profiler
+        return Profiler(self)
+
+    def dictionary_version(self):
+        """
+        Returns a digest identifying the pronunciation dictionary in use.
+        """
+        return self._pronunciations.version
+
+    def rejected_by(self, text):
+        """
+        Returns the name of the first rule, cheapest first, that text breaks,
+        or None if text is a limerick.
+        """
         a_lines, b_lines = self._get_lines(text)
-        if (len(a_lines) + len(b_lines) != 5): return False
-        if not (len(a_lines) == 3 and len(b_lines) == 2): return False
-
-        # check line-level syllable count
-        a_num_syllables = [self._line_num_syllables(line) for line in a_lines]
-        b_num_syllables = [self._line_num_syllables(line) for line in b_lines]
-        if sum(a_num_syllables) < 4 or sum(b_num_syllables) < 4: return False
-       
-        # check inter-line level syllable count difference
-        if not self._is_valid_diff(a_num_syllables, b_num_syllables): return False
-        
-        # All A lines must rhyme with each other
-        if not self._lines_do_rhyme(a_lines): return False 
-        
-        # All B lines must rhyme with each other
-        if not self._lines_do_rhyme(b_lines): return False 
-        
-        # A lines and B lines must not rhyme with each other 
-        combined = [a_lines[0], b_lines[0]]
-        if self._lines_do_rhyme(combined): return False 
-       
+        if self.cache is None:
+          return self._check_rules(a_lines, b_lines)
+        # the verdict depends on the normalized lines and on how they are judged
+        if self._cache_prefix is None:
+          self._cache_prefix = " ".join([self.dictionary_version(), self._config] +
+                                        [rule.name for rule in self._rules])
+        key = self.cache.key(self._cache_prefix, "\n".join(a_lines), "\n".join(b_lines))
+        found, rejected = self.cache.get(key)
+        if not found:
+          rejected = self._check_rules(a_lines, b_lines)
+          self.cache.put(key, rejected)
+        return rejected
+
+    def _check_rules(self, a_lines, b_lines):
+        """
+        Returns the name of the first rule the normalized A and B lines break,
+        or None.
+        """
+        a_lines = [self._analyze_line(line) for line in a_lines]
+        b_lines = [self._analyze_line(line) for line in b_lines]
+        for rule in self._rules:
+          if not rule.check(self, a_lines, b_lines):
+            return rule.name
         # All constraints have been addressed; assume the text is a limerick
-        return True 
+        return None
+
+    def are_limericks(self, texts):
+        """
+        Returns [self.is_limerick(text) for text in texts]. Poems are first
+        checked one by one against the rules in MASK_PREREQUISITES, then the
+        rules in SYLLABLE_RULES are applied to the survivors' syllable counts
+        all at once with syllable_mask, and only poems passing the mask go on
+        to the remaining (rhyme) rules, so most non-limericks never reach a
+        suffix lookup. Needs numpy.
+        """
+        import numpy as np
+        batched = [rule for rule in self._rules if rule.name in SYLLABLE_RULES]
+        before = [rule for rule in self._rules if rule.name in MASK_PREREQUISITES]
+        after = [rule for rule in self._rules if rule not in batched and rule not in before]
+
+        verdicts = [False] * len(texts)
+        survivors = []
+        for row, text in enumerate(texts):
+          a_lines, b_lines = self._get_lines(text)
+          a_lines = [self._analyze_line(line) for line in a_lines]
+          b_lines = [self._analyze_line(line) for line in b_lines]
+          if all(rule.check(self, a_lines, b_lines) for rule in before):
+            survivors.append((row, a_lines, b_lines))
+        if batched and survivors:
+          counts = np.array([[line.syllables for line in (a[0], a[1], b[0], b[1], a[2])]
+                             for row, a, b in survivors], dtype=int)
+          survivors = [poem for poem, passed in izip(survivors, syllable_mask(counts)) if passed]
+        for row, a_lines, b_lines in survivors:
+          verdicts[row] = all(rule.check(self, a_lines, b_lines) for rule in after)
+        return verdicts
 
 
     
@@ -247,12 +593,7 @@ class LimerickDetector:
       """
       Return the number of vowels found in the input word.
       """
-      vowels = ['a', 'e', 'i', 'o', 'u']
-      count = 0
-      for i in range(len(word)):
-        if word[i] in vowels:
-          count += 1
-      return count 
+      return len(_VOWELS.findall(word))
     
     def _has_silent_vowel(self, word):
       """
@@ -266,11 +607,8 @@ class LimerickDetector:
       Return the number of dipthongs in the input word. A dipthong is a pair of
       vowels making up one sound.
       """
-      # common dipthongs; obviously, there are more
-      dipthongs = list(set(["au", "oi", "ou", "ai", "ei", "oa", "oe", "io" "ea", 
-                            "eu", "aa", "ee", "oo"]))
       count = 0
-      for d in dipthongs:
+      for d in _DIPTHONGS:
         if d in word: count += 1
       return count
     
@@ -292,6 +630,7 @@ class LimerickDetector:
       Guesses the number of syllables in a word. Extra credit function.
       """
       word = word.lower()
+      if not word: return 0
       vowel_count = self._get_vowel_count(word)
       
       # does it have a silent vowel at the end?
@@ -326,6 +665,191 @@ class LimerickDetector:
       return limerick
 
 
+def read_poems(infile, fmt, errors=None):
+  """
+  Lazily yield (id, text) for each poem in infile. With fmt "blank", poems are
+  separated by blank lines and numbered from 0; with fmt "jsonl", each line is
+  a JSON string or an object with a "text" field and an optional "id". A jsonl
+  line that isn't valid JSON or has no text raises ValueError, unless errors
+  is a list: then (id, message) is appended to it and the line is skipped.
+  """
+  if fmt == "jsonl":
+    for number, line in enumerate(infile):
+      if not line.strip():
+        continue
+      poem_id = number
+      try:
+        text = json.loads(line)
+        if isinstance(text, dict):
+          poem_id = text.get("id", number)
+          text = text.get("text")
+        if not isinstance(text, (str, type(u""))):
+          raise ValueError("no poem text")
+      except ValueError as msg:
+        if errors is None:
+          raise
+        errors.append((poem_id, "line %d: %s" % (number + 1, msg)))
+        continue
+      yield poem_id, text
+  else:
+    number = 0
+    poem = []
+    for line in infile:
+      if line.strip():
+        poem.append(line)
+      elif poem:
+        yield number, ''.join(poem)
+        number += 1
+        poem = []
+    if poem:
+      yield number, ''.join(poem)
+
+def scan_limericks(ld, lines):
+  """
+  Lazily yield (line number, text) for every run of five consecutive non-empty
+  lines in the iterable lines that ld judges a limerick, numbering lines from
+  1. Each line is analyzed once, when it enters the window, and its
+  _LineRecord is reused by the five windows it belongs to, so a document of n
+  lines costs O(n) dictionary lookups.
+  """
+  window = deque(maxlen=5)
+  for number, line in enumerate(lines, 1):
+    if not line.strip():
+      continue
+    window.append((number, line, ld._analyze_line(ld._normalize_line(line))))
+    if len(window) < 5:
+      continue
+    records = [record for n, text, record in window]
+    a_lines = [records[0], records[1], records[4]]
+    b_lines = [records[2], records[3]]
+    if all(rule.check(ld, a_lines, b_lines) for rule in ld._rules):
+      yield window[0][0], ''.join(text for n, text, record in window)
+
+# the detector handed to pool workers; set before forking so they inherit it
+_pool_detector = None
+
+def _classify_batch(texts):
+  """
+  Classify texts in a pool worker. Returns the verdicts, the worker's result
+  cache hits and misses on them and, if the detector is being profiled, its
+  profile of them, for the parent to add up.
+  """
+  cache = _pool_detector.cache
+  hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+  profiler = _pool_detector._profiler
+  if profiler is not None:
+    # drop the counts copied from the parent at fork, or already sent back
+    profiler.drain()
+  verdicts = [_pool_detector.is_limerick(text) for text in texts]
+  if cache is not None:
+    hits, misses = cache.hits - hits, cache.misses - misses
+  return verdicts, hits, misses, profiler.drain() if profiler is not None else None
+
+def classify_poems(ld, poems, workers=1, batch_size=64):
+  """
+  Yield ld.is_limerick(text) for each text in the iterable poems, in order.
+  With more than one worker, batches of poems are classified by a pool of
+  processes forked after ld was built, so they share its dictionary
+  copy-on-write (or the same pages of a memory-mapped index). At most two
+  batches per worker are in flight, so poems is consumed lazily.
+  """
+  global _pool_detector
+  if workers <= 1:
+    for text in poems:
+      yield ld.is_limerick(text)
+    return
+  import multiprocessing
+  ld.load()
+  _pool_detector = ld
+  context = multiprocessing.get_context("fork") if hasattr(multiprocessing, "get_context") else multiprocessing
+  pool = context.Pool(workers)
+  try:
+    poems = iter(poems)
+    pending = deque()
+    while True:
+      batch = list(islice(poems, batch_size))
+      if batch:
+        pending.append(pool.apply_async(_classify_batch, (batch,)))
+      while pending and (not batch or len(pending) >= 2 * workers):
+        verdicts, hits, misses, profile = pending.popleft().get()
+        if ld.cache is not None:
+          ld.cache.hits += hits
+          ld.cache.misses += misses
+        if profile is not None:
+          ld._profiler.merge(profile)
+        for verdict in verdicts:
+          yield verdict
+      if not batch:
+        break
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
+    _pool_detector = None
+
+def classify_stream(ld, infile, outfile, fmt, workers=1):
+  """
+  Classify every poem in infile with ld, writing one verdict per poem to
+  outfile as soon as it is known. A jsonl record that can't be read gets an
+  {"id": ..., "error": ...} line in its place instead of stopping the run.
+  Returns (poem count, unreadable record count, seconds spent loading the
+  dictionary, seconds spent classifying).
+  """
+  count = 0
+  errors = []
+  # (id, None) for each poem being classified and (id, message) for each
+  # unreadable record, in input order
+  pending = deque()
+  def texts():
+    for poem_id, text in read_poems(infile, fmt, errors=errors):
+      pending.extend(errors)
+      del errors[:]
+      pending.append((poem_id, None))
+      yield text
+    pending.extend(errors)
+  def write_errors():
+    written = 0
+    while pending and pending[0][1] is not None:
+      poem_id, message = pending.popleft()
+      outfile.write(json.dumps({"id": poem_id, "error": message})+"\n")
+      written += 1
+    return written
+  poems = texts()
+  first = next(poems, None)
+  load_seconds = 0.0
+  if first is not None:
+    # the dictionary is loaded lazily; load it now so that isn't counted as classifying
+    loading = time.time()
+    ld.load()
+    load_seconds = time.time() - loading
+    poems = chain([first], poems)
+  start = time.time()
+  failed = 0
+  for verdict in classify_poems(ld, poems, workers=workers):
+    failed += write_errors()
+    poem_id = pending.popleft()[0]
+    if fmt == "jsonl":
+      outfile.write(json.dumps({"id": poem_id, "limerick": verdict})+"\n")
+    else:
+      outfile.write("{}\n".format(verdict))
+    count += 1
+  failed += write_errors()
+  return count, failed, load_seconds, time.time() - start
+
+
+def write_profile(profiler, fmt, path=None):
+  """
+  Write profiler's counts as "json" or "prometheus" text to the file at
+  path, or to stderr.
+  """
+  text = profiler.to_json()+"\n" if fmt == "json" else profiler.to_prometheus()
+  if path is None:
+    sys.stderr.write(text)
+  else:
+    with open(path, 'w') as fh:
+      fh.write(text)
+
+
 # The code below should not need to be modified
 def main():
   parser = argparse.ArgumentParser(description="limerick detector. Given a file containing a poem, indicate whether that poem is a limerick or not",
@@ -333,6 +857,13 @@ def main():
   addonoffarg(parser, 'debug', help="debug mode", default=False)
   parser.add_argument("--infile", "-i", nargs='?', type=argparse.FileType('r'), default=sys.stdin, help="input file")
   parser.add_argument("--outfile", "-o", nargs='?', type=argparse.FileType('w'), default=sys.stdout, help="output file")
+  parser.add_argument("--index", default=None, help="pronunciation index compiled by cmuindex.py (default: parse cmudict)")
+  parser.add_argument("--tokenizer", choices=["regex", "nltk"], default="regex", help="word splitter used on poem lines")
+  parser.add_argument("--cache", default=None, help="sqlite file to keep verdicts in between runs")
+  parser.add_argument("--workers", "-w", type=int, default=1, help="worker processes for --format blank/jsonl")
+  parser.add_argument("--format", "-f", choices=["poem", "blank", "jsonl", "scan", "scheme"], default="poem", help="input is one poem, blank-line-separated poems, JSON lines with one poem each, or a long text to search for limericks (written out as JSON lines); scheme writes the rhyme scheme of one poem instead of a verdict")
+  parser.add_argument("--profile", choices=["json", "prometheus"], default=None, help="count and time the detector's hot calls and dictionary misses, and write them in this format when done")
+  parser.add_argument("--profile-file", default=None, help="file to write --profile output to (default: stderr)")
 
 
 
@@ -345,8 +876,28 @@ def main():
   infile = prepfile(args.infile, 'r')
   outfile = prepfile(args.outfile, 'w')
 
-  ld = LimerickDetector()
+  ld = LimerickDetector(index=args.index, tokenizer=args.tokenizer, cache=args.cache)
+  if args.profile:
+    profiler = ld.profile().start()
+    atexit.register(write_profile, profiler, args.profile, args.profile_file)
+  if args.format == "scan":
+    for number, text in scan_limericks(ld, infile):
+      outfile.write(json.dumps({"line": number, "text": text})+"\n")
+    return
+  if args.format not in ("poem", "scheme"):
+    count, failed, load_seconds, elapsed = classify_stream(ld, infile, outfile, args.format, workers=args.workers)
+    sys.stderr.write("loaded the dictionary in {:.2f}s, classified {} poems in {:.2f}s ({:.1f} poems/s)\n".format(
+      load_seconds, count, elapsed, count / elapsed if elapsed else 0.0))
+    if failed:
+      sys.stderr.write("skipped {} unreadable records\n".format(failed))
+    if ld.cache is not None:
+      sys.stderr.write("cache: {hits} hits, {misses} misses ({hit_rate:.1%} hit rate)\n".format(**ld.cache.stats()))
+    return
   lines = ''.join(infile.readlines())
+  if args.format == "scheme":
+    scheme = ld.rhyme_scheme(lines)
+    outfile.write(("" if all(len(label) == 1 for label in scheme) else " ").join(scheme)+"\n")
+    return
   outfile.write("{}\n-----------\n{}\n".format(lines.strip(), ld.is_limerick(lines)))
 
 if __name__ == '__main__':
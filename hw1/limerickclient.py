@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# client for limerickd.py, and a latency benchmark against the cold limerick.py cli
+import argparse
+import sys
+if sys.version_info[0] == 2:
+  from itertools import izip
+else:
+  izip = zip
+import os
+import os.path
+import json
+import time
+import socket
+import tempfile
+import subprocess
+
+from fileio import prepfile
+
+
+scriptdir = os.path.dirname(os.path.abspath(__file__))
+
+
+def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
+  ''' add the switches --arg and --no-arg that set parser.arg to true/false, respectively'''
+  group = parser.add_mutually_exclusive_group()
+  dest = arg if dest is None else dest
+  group.add_argument('--%s' % arg, dest=dest, action='store_true', default=default, help=help)
+  group.add_argument('--no-%s' % arg, dest=dest, action='store_false', default=default, help="See --%s" % arg)
+
+
+DEFAULT_SOCKET = os.path.join(os.getenv('TMPDIR', '/tmp'), "limerickd.sock")
+
+
+class LimerickError(Exception):
+  """
+  The server could not answer a request.
+  """
+
+
+class LimerickClient(object):
+  """
+  Talks to a limerickd.py server. Each method sends one request and waits for
+  its answer; pipeline() sends many requests before reading the answers.
+  """
+
+  # requests in flight at once; stays below the server's read-ahead so neither
+  # side can block writing while the other is blocked writing too
+  WINDOW = 128
+
+  def __init__(self, path=DEFAULT_SOCKET):
+    self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self._sock.connect(path)
+    self._responses = self._sock.makefile('rb')
+    self._next_id = 0
+
+  def _send(self, requests):
+    payload = []
+    for request in requests:
+      request = dict(request, id=self._next_id)
+      self._next_id += 1
+      payload.append(json.dumps(request).encode('utf8') + b"\n")
+    self._sock.sendall(b"".join(payload))
+
+  def _receive(self):
+    line = self._responses.readline()
+    if not line:
+      raise LimerickError("server closed the connection")
+    response = json.loads(line.decode('utf8'))
+    if "error" in response:
+      raise LimerickError(response["error"])
+    return response["result"]
+
+  def pipeline(self, requests):
+    """
+    Send requests (dicts with an "op" and its arguments) and return their
+    results in order, keeping up to WINDOW of them in flight.
+    """
+    results = []
+    requests = list(requests)
+    for start in range(0, len(requests), self.WINDOW):
+      window = requests[start:start + self.WINDOW]
+      self._send(window)
+      results.extend(self._receive() for request in window)
+    return results
+
+  def is_limerick(self, text):
+    return self.pipeline([{"op": "is_limerick", "text": text}])[0]
+
+  def are_limericks(self, texts):
+    return self.pipeline({"op": "is_limerick", "text": text} for text in texts)
+
+  def rhymes(self, a, b):
+    return self.pipeline([{"op": "rhymes", "a": a, "b": b}])[0]
+
+  def num_syllables(self, word):
+    return self.pipeline([{"op": "num_syllables", "word": word}])[0]
+
+  def close(self):
+    self._responses.close()
+    self._sock.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+
+def _percentile(values, fraction):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def benchmark(path, poem, requests, cold_runs):
+  """
+  Time requests sequential and pipelined is_limerick calls on poem against the
+  server, and cold_runs runs of the limerick.py cli on the same poem.
+  """
+  results = {}
+  with LimerickClient(path) as client:
+    latencies = []
+    for i in range(requests):
+      start = time.time()
+      client.is_limerick(poem)
+      latencies.append(time.time() - start)
+    results["daemon_p50_ms"] = 1000 * _percentile(latencies, 0.5)
+    results["daemon_p99_ms"] = 1000 * _percentile(latencies, 0.99)
+    start = time.time()
+    client.are_limericks([poem] * requests)
+    results["daemon_pipelined_per_sec"] = requests / (time.time() - start)
+
+  fd, poemfile = tempfile.mkstemp(suffix=".txt")
+  with os.fdopen(fd, 'w') as fh:
+    fh.write(poem)
+  try:
+    latencies = []
+    with open(os.devnull, 'w') as devnull:
+      for i in range(cold_runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, os.path.join(scriptdir, "limerick.py"), "-i", poemfile],
+                              stdout=devnull)
+        latencies.append(time.time() - start)
+    results["cold_cli_p50_ms"] = 1000 * _percentile(latencies, 0.5)
+  finally:
+    os.remove(poemfile)
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser(description="ask a running limerickd.py whether a poem is a limerick",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  addonoffarg(parser, 'debug', help="debug mode", default=False)
+  parser.add_argument("--infile", "-i", nargs='?', type=argparse.FileType('r'), default=sys.stdin, help="input file")
+  parser.add_argument("--outfile", "-o", nargs='?', type=argparse.FileType('w'), default=sys.stdout, help="output file")
+  parser.add_argument("--socket", "-s", default=DEFAULT_SOCKET, help="unix socket the server listens on")
+  parser.add_argument("--bench", type=int, default=0, help="instead of one verdict, time this many requests for the input poem against the server and the cold cli, and write the results as json")
+  parser.add_argument("--cold-runs", type=int, default=3, help="cold cli runs to time with --bench")
+
+  try:
+    args = parser.parse_args()
+  except IOError as msg:
+    parser.error(str(msg))
+
+  infile = prepfile(args.infile, 'r')
+  outfile = prepfile(args.outfile, 'w')
+
+  lines = ''.join(infile.readlines())
+  if args.bench:
+    outfile.write(json.dumps(benchmark(args.socket, lines, args.bench, args.cold_runs), indent=2, sort_keys=True)+"\n")
+    return
+  with LimerickClient(args.socket) as client:
+    outfile.write("{}\n-----------\n{}\n".format(lines.strip(), client.is_limerick(lines)))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# keep a warm LimerickDetector resident and answer requests over a unix socket
+import argparse
+import sys
+import os
+import os.path
+import json
+import signal
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from limerick import LimerickDetector
+from limerickclient import DEFAULT_SOCKET
+
+scriptdir = os.path.dirname(os.path.abspath(__file__))
+
+
+def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
+  ''' add the switches --arg and --no-arg that set parser.arg to true/false, respectively'''
+  group = parser.add_mutually_exclusive_group()
+  dest = arg if dest is None else dest
+  group.add_argument('--%s' % arg, dest=dest, action='store_true', default=default, help=help)
+  group.add_argument('--no-%s' % arg, dest=dest, action='store_false', default=default, help="See --%s" % arg)
+
+
+# Protocol: one JSON object per line each way. A request is
+#   {"id": any, "op": "is_limerick", "text": "..."}
+#   {"id": any, "op": "rhymes", "a": "...", "b": "..."}
+#   {"id": any, "op": "num_syllables", "word": "..."}
+# and is answered by {"id": same, "result": ...} or {"id": same, "error": "..."}.
+# Clients may pipeline: send many requests without waiting. Responses on a
+# connection come back in request order.
+
+# longest request line accepted
+MAX_REQUEST = 1 << 20
+# requests read ahead of the response being written, per connection
+MAX_PIPELINE = 256
+
+# the detector; set before the worker pool forks so the workers inherit it
+_detector = None
+
+def _is_limerick(text):
+  return _detector.is_limerick(text)
+
+def _answer(request):
+  """
+  Run a request that is cheap enough to answer without a worker.
+  """
+  op = request.get("op")
+  if op == "rhymes":
+    return _detector.rhymes(request["a"], request["b"])
+  if op == "num_syllables":
+    return _detector.num_syllables(request["word"])
+  raise ValueError("unknown op: %r" % op)
+
+
+class LimerickServer(object):
+  """
+  Serves a LimerickDetector on a unix socket. is_limerick requests run in a
+  pool of worker processes (or in the event loop if workers is 0); rhymes and
+  num_syllables are dictionary probes and are answered directly.
+  """
+
+  def __init__(self, ld, path, workers=0):
+    global _detector
+    _detector = ld
+    self.path = path
+    self.workers = workers
+    self._pool = None
+
+  async def _run(self, request):
+    if request.get("op") == "is_limerick":
+      if self._pool is None:
+        return _is_limerick(request["text"])
+      loop = asyncio.get_running_loop()
+      return await loop.run_in_executor(self._pool, _is_limerick, request["text"])
+    return _answer(request)
+
+  async def _respond(self, line):
+    try:
+      request = json.loads(line)
+    except ValueError as msg:
+      return {"id": None, "error": "bad request: %s" % msg}
+    if not isinstance(request, dict):
+      return {"id": None, "error": "bad request: not an object"}
+    try:
+      return {"id": request.get("id"), "result": await self._run(request)}
+    except Exception as msg:
+      return {"id": request.get("id"), "error": "%s: %s" % (type(msg).__name__, msg)}
+
+  async def _write_responses(self, pending, writer):
+    while True:
+      response = await pending.get()
+      if response is None:
+        break
+      writer.write((json.dumps(await response)+"\n").encode('utf8'))
+      # returns at once unless the client isn't reading its responses, in which
+      # case this waits (and the queue fills, and reading stops) until it does;
+      # it also raises once the client has gone
+      await writer.drain()
+
+  async def _refuse(self, message):
+    return {"id": None, "error": message}
+
+  async def _handle(self, reader, writer):
+    # requests start as soon as they are read; the writer task sends their
+    # results back in order, and the bounded queue stops reading ahead when a
+    # client pipelines faster than we answer
+    pending = asyncio.Queue(MAX_PIPELINE)
+    responses = asyncio.ensure_future(self._write_responses(pending, writer))
+    # if writing fails (the client went away) while we are blocked on a full
+    # queue, nothing would ever make room in it: stop reading instead
+    reading = True
+    handler = asyncio.current_task()
+    def writer_done(task):
+      if reading and not task.cancelled() and task.exception() is not None:
+        handler.cancel()
+    responses.add_done_callback(writer_done)
+    try:
+      while True:
+        try:
+          line = await reader.readline()
+        except ValueError:
+          # longer than MAX_REQUEST; there is no telling where the next request starts
+          await pending.put(asyncio.ensure_future(self._refuse("bad request: longer than %d bytes" % MAX_REQUEST)))
+          break
+        if not line:
+          break
+        if line.strip():
+          await pending.put(asyncio.ensure_future(self._respond(line.decode('utf8'))))
+      await pending.put(None)
+      reading = False
+      await responses
+    except asyncio.CancelledError:
+      if not responses.done():
+        raise
+    except ConnectionError:
+      # the client is gone
+      pass
+    finally:
+      reading = False
+      responses.cancel()
+      # drop the answers nobody will read
+      while not pending.empty():
+        response = pending.get_nowait()
+        if response is not None:
+          response.cancel()
+      writer.close()
+
+  async def serve(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
+    # load the dictionary up front, so the first request isn't slow and forked workers share it
+    _detector.load()
+    if self.workers > 0:
+      self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("fork"))
+    server = await asyncio.start_unix_server(self._handle, path=self.path, limit=MAX_REQUEST)
+    loop = asyncio.get_running_loop()
+    stop = loop.create_future()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+      loop.add_signal_handler(sig, functools.partial(stop.set_result, None))
+    try:
+      await stop
+    finally:
+      server.close()
+      await server.wait_closed()
+      if self._pool is not None:
+        self._pool.shutdown()
+      os.remove(self.path)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="serve is_limerick, rhymes and num_syllables over a unix socket as newline-delimited json",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  addonoffarg(parser, 'debug', help="debug mode", default=False)
+  parser.add_argument("--socket", "-s", default=DEFAULT_SOCKET, help="unix socket to listen on")
+  parser.add_argument("--workers", "-w", type=int, default=os.cpu_count(), help="worker processes for is_limerick (0 to run in the server)")
+  parser.add_argument("--index", default=None, help="pronunciation index compiled by cmuindex.py (default: parse cmudict)")
+  parser.add_argument("--tokenizer", choices=["regex", "nltk"], default="regex", help="word splitter used on poem lines")
+  parser.add_argument("--cache", default=None, help="sqlite file to keep verdicts in between runs")
+
+  try:
+    args = parser.parse_args()
+  except IOError as msg:
+    parser.error(str(msg))
+
+  ld = LimerickDetector(index=args.index, tokenizer=args.tokenizer, cache=args.cache)
+  if args.debug:
+    sys.stderr.write("listening on {}\n".format(args.socket))
+  asyncio.run(LimerickServer(ld, args.socket, workers=args.workers).serve())
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,218 @@
+# opt-in instrumentation for LimerickDetector: call counts, latency histograms and dictionary miss rates
+import copy
+import json
+import time
+from bisect import bisect_left
+
+
+_clock = getattr(time, "perf_counter", time.time)
+
+# upper bounds, in seconds, of the latency histogram buckets; the last bucket is unbounded
+BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 1e-2, 0.1, 1.0)
+
+# detector methods a Profiler times: the is_limerick path, where _tokenize is
+# the word splitter the detector was built with and _suffixes_rhyme the test
+# _lines_do_rhyme compares each line's suffixes with, and rhymes and
+# _get_suffix_list, which the daemon's rhymes op and API callers reach directly
+PROFILED = ("is_limerick", "_normalize_line", "_tokenize", "num_syllables",
+            "_lines_do_rhyme", "_suffixes_rhyme", "rhymes", "_get_suffix_list")
+
+# pronunciation tables whose lookups a Profiler times (as "lookup:<table>") and
+# counts, with the misses: words num_syllables looks up in the syllable table,
+# and words whose suffixes are looked up for rhyming
+TABLES = ("syllables", "suffixes")
+
+_MISSING = object()
+
+
+class Histogram(object):
+  """
+  Call count, total seconds, and counts of calls per latency bucket.
+  """
+  __slots__ = ('count', 'total', 'buckets')
+
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    self.buckets = [0] * (len(BUCKETS) + 1)
+
+  def add(self, seconds):
+    self.count += 1
+    self.total += seconds
+    self.buckets[bisect_left(BUCKETS, seconds)] += 1
+
+  def cumulative(self):
+    """
+    Return [(upper bound, calls at most that slow)], ending with ("+Inf", count).
+    """
+    total = 0
+    counts = []
+    for bound, count in zip(BUCKETS + ("+Inf",), self.buckets):
+      total += count
+      counts.append((bound, total))
+    return counts
+
+
+class _ProbedTable(object):
+  """
+  Stands in for a pronunciation table on a profiled detector: get is timed
+  and counted, anything else goes to the table.
+  """
+
+  def __init__(self, table, get):
+    self._table = table
+    self.get = get
+
+  def __getattr__(self, name):
+    return getattr(self._table, name)
+
+
+class Profiler(object):
+  """
+  Times a LimerickDetector's hot methods (PROFILED), its table lookups (TABLES)
+  and each of its rules while active, e.g. with ld.profile() as profiler: ...
+  Timed calls and tables are shadowed on the detector instance by wrappers,
+  which stop() removes again, so a detector that isn't being profiled runs
+  exactly the code it always did. Latencies are inclusive: a rule's time
+  includes the num_syllables calls it makes, and _lines_do_rhyme's the suffix
+  lookups and _suffixes_rhyme tests.
+  """
+
+  def __init__(self, ld):
+    self.ld = ld
+    self.timings = {}
+    self.lookups = dict((table, 0) for table in TABLES)
+    self.misses = dict((table, 0) for table in TABLES)
+    self._saved = None
+
+  def _histogram(self, name):
+    if name not in self.timings:
+      self.timings[name] = Histogram()
+    return self.timings[name]
+
+  def _timed(self, name, call):
+    add = self._histogram(name).add
+    def timed(*args, **kwargs):
+      start = _clock()
+      try:
+        return call(*args, **kwargs)
+      finally:
+        add(_clock() - start)
+    return timed
+
+  def _probed(self, table, lookup):
+    add = self._histogram("lookup:" + table).add
+    lookups, misses = self.lookups, self.misses
+    def get(word, default=None):
+      start = _clock()
+      value = lookup(word)
+      add(_clock() - start)
+      lookups[table] += 1
+      if value is None:
+        misses[table] += 1
+        return default
+      return value
+    return get
+
+  def start(self):
+    ld = self.ld
+    if ld._profiler is not None:
+      raise RuntimeError("the detector is already being profiled")
+    # load the dictionary first, so its load time isn't charged to the first lookup
+    ld.load()
+    tables = tuple("_" + table for table in TABLES)
+    self._saved = dict((name, ld.__dict__.get(name, _MISSING)) for name in PROFILED + tables + ("_rules",))
+    for name in PROFILED:
+      setattr(ld, name, self._timed(name, getattr(ld, name)))
+    for table, name in zip(TABLES, tables):
+      original = getattr(ld, name)
+      setattr(ld, name, _ProbedTable(original, self._probed(table, original.get)))
+    rules = []
+    for rule in ld._rules:
+      rule = copy.copy(rule)
+      rule.check = self._timed("rule:" + rule.name, rule.check)
+      rules.append(rule)
+    ld._rules = rules
+    ld._profiler = self
+    return self
+
+  def stop(self):
+    ld = self.ld
+    for name, value in self._saved.items():
+      if value is _MISSING:
+        delattr(ld, name)
+      else:
+        setattr(ld, name, value)
+    ld._profiler = None
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *exc):
+    self.stop()
+
+  def drain(self):
+    """
+    Return the counts so far as plain data (for merge) and reset them.
+    """
+    snapshot = {"timings": dict((name, (h.count, h.total, list(h.buckets))) for name, h in self.timings.items()),
+                "lookups": dict(self.lookups), "misses": dict(self.misses)}
+    for histogram in self.timings.values():
+      # reset in place: the wrappers hold on to the histograms
+      histogram.count, histogram.total = 0, 0.0
+      histogram.buckets[:] = [0] * len(histogram.buckets)
+    for table in TABLES:
+      self.lookups[table] = self.misses[table] = 0
+    return snapshot
+
+  def merge(self, snapshot):
+    """
+    Add counts returned by another profiler's drain(), e.g. a pool worker's.
+    """
+    for name, (count, total, buckets) in snapshot["timings"].items():
+      histogram = self._histogram(name)
+      histogram.count += count
+      histogram.total += total
+      histogram.buckets = [a + b for a, b in zip(histogram.buckets, buckets)]
+    for table in TABLES:
+      self.lookups[table] += snapshot["lookups"][table]
+      self.misses[table] += snapshot["misses"][table]
+
+  def stats(self):
+    """
+    Return the counts as a dict: per call, its count, total and mean seconds
+    and cumulative latency buckets; per dictionary table, lookups, misses and
+    miss rate.
+    """
+    calls = {}
+    for name, histogram in sorted(self.timings.items()):
+      calls[name] = {"calls": histogram.count, "total_s": histogram.total,
+                     "mean_s": histogram.total / histogram.count if histogram.count else 0.0,
+                     "buckets": [[str(bound), count] for bound, count in histogram.cumulative()]}
+    dictionary = {}
+    for table in TABLES:
+      lookups, misses = self.lookups[table], self.misses[table]
+      dictionary[table] = {"lookups": lookups, "misses": misses,
+                           "miss_rate": float(misses) / lookups if lookups else 0.0}
+    return {"calls": calls, "dictionary": dictionary}
+
+  def to_json(self):
+    return json.dumps(self.stats(), indent=2, sort_keys=True)
+
+  def to_prometheus(self, prefix="limerick"):
+    """
+    Return the counts in the Prometheus text exposition format.
+    """
+    lines = ["# HELP %s_call_seconds Latency of LimerickDetector calls, including the calls they make." % prefix,
+             "# TYPE %s_call_seconds histogram" % prefix]
+    for name, histogram in sorted(self.timings.items()):
+      for bound, count in histogram.cumulative():
+        lines.append('%s_call_seconds_bucket{call="%s",le="%s"} %d' % (prefix, name, bound, count))
+      lines.append('%s_call_seconds_sum{call="%s"} %r' % (prefix, name, histogram.total))
+      lines.append('%s_call_seconds_count{call="%s"} %d' % (prefix, name, histogram.count))
+    for kind, counts in (("lookups", self.lookups), ("misses", self.misses)):
+      lines.append("# HELP %s_dictionary_%s_total Words looked up in (or missing from) a pronunciation table." % (prefix, kind))
+      lines.append("# TYPE %s_dictionary_%s_total counter" % (prefix, kind))
+      for table in TABLES:
+        lines.append('%s_dictionary_%s_total{table="%s"} %d' % (prefix, kind, table, counts[table]))
+    return "\n".join(lines) + "\n"
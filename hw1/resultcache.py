@@ -0,0 +1,89 @@
+# persistent cache of limerick verdicts shared between runs and worker processes
+import os
+import sqlite3
+import hashlib
+
+
+class ResultCache(object):
+  """
+  Maps poem keys to the rule that rejected the poem (None for a limerick) in a
+  local SQLite file. Safe to share between processes: each process opens its
+  own connection, and the database runs in WAL mode so readers don't block the
+  writer. Once it holds more than max_entries verdicts the oldest are evicted.
+  """
+
+  # how many inserts to make between checks of the table size
+  EVICT_EVERY = 1000
+
+  def __init__(self, path, max_entries=1000000):
+    self.path = path
+    self.max_entries = max_entries
+    self.hits = 0
+    self.misses = 0
+    self._inserts = 0
+    self._db = None
+    self._pid = None
+
+  def _connect(self):
+    # a connection must not cross a fork, so each process opens its own
+    if self._pid != os.getpid():
+      self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+      self._db.execute("PRAGMA journal_mode=WAL")
+      self._db.execute("PRAGMA synchronous=NORMAL")
+      self._db.execute("CREATE TABLE IF NOT EXISTS verdicts "
+                       "(id INTEGER PRIMARY KEY, key TEXT UNIQUE, rejected_by TEXT)")
+      self._pid = os.getpid()
+    return self._db
+
+  @staticmethod
+  def key(*parts):
+    """
+    Return the cache key for the given strings.
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+      digest.update(part.encode('utf8') if not isinstance(part, bytes) else part)
+      digest.update(b'\0')
+    return digest.hexdigest()
+
+  def get(self, key):
+    """
+    Return (True, rejected_by) if key is cached, (False, None) if not.
+    """
+    row = self._connect().execute("SELECT rejected_by FROM verdicts WHERE key = ?", (key,)).fetchone()
+    if row is None:
+      self.misses += 1
+      return False, None
+    self.hits += 1
+    return True, row[0]
+
+  def put(self, key, rejected_by):
+    db = self._connect()
+    db.execute("INSERT OR IGNORE INTO verdicts (key, rejected_by) VALUES (?, ?)", (key, rejected_by))
+    self._inserts += 1
+    if self._inserts % self.EVICT_EVERY == 0:
+      self.evict()
+
+  def evict(self):
+    """
+    Drop the oldest verdicts until at most max_entries are left.
+    """
+    db = self._connect()
+    excess = db.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0] - self.max_entries
+    if excess > 0:
+      db.execute("DELETE FROM verdicts WHERE id IN "
+                 "(SELECT id FROM verdicts ORDER BY id LIMIT ?)", (excess,))
+
+  def stats(self):
+    """
+    Return this process's hit and miss counts and hit rate.
+    """
+    lookups = self.hits + self.misses
+    return {"hits": self.hits, "misses": self.misses,
+            "hit_rate": self.hits / float(lookups) if lookups else 0.0}
+
+  def close(self):
+    if self._db is not None and self._pid == os.getpid():
+      self._db.close()
+    self._db = None
+    self._pid = None
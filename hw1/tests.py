@@ -1,4 +1,19 @@
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
 import unittest
+import subprocess
+from cmuindex import compile_index
+from resultcache import ResultCache
+from fileio import prepfile, ParallelGzipWriter
+from limerickclient import LimerickClient, LimerickError
+try:
+    import numpy
+except ImportError:
+    numpy = None
 try:
     from limerick3 import LimerickDetector
 except:
@@ -106,5 +121,309 @@ and horribly horribly dated"""
         self.assertEqual(self.ld.is_limerick(h), False)
         self.assertEqual(self.ld.is_limerick(j), True)
 
+    def test_rhymes_many(self):
+        words = ["dog", "Bog", "cat", "blorptastic", "hat", "fog", "blorptastic"]
+        matrix = self.ld.rhymes_many(words)
+        self.assertEqual(matrix, [[self.ld.rhymes(a, b) for b in words] for a in words])
+        self.assertEqual(self.ld.rhyme_classes(words), [[0, 1, 5], [2, 4], [3], [6]])
+        self.assertEqual("".join(self.ld.rhyme_scheme(self.ld.my_limerick())), "AABBA")
+        couplets = "The cat\nsat on a mat\nthe dog\nin a fog\nthe end"
+        self.assertEqual(self.ld.rhyme_scheme(couplets), ["A", "A", "B", "B", "C"])
+
+    def test_rhyming_words(self):
+        words = self.ld.rhyming_words("dog")
+        self.assertIn("bog", words)
+        self.assertNotIn("dog", words)
+        self.assertNotIn("cat", words)
+        for word in words:
+            self.assertEqual(self.ld.rhymes("dog", word), True)
+        self.assertEqual(self.ld.rhyming_words("Dog", limit=3), words[:3])
+        self.assertEqual(self.ld.rhyming_words("asdf"), [])
+
+    def test_oov_syllables(self):
+        self.assertEqual(self.ld.num_syllables("blorptastic"), 3)
+        self.assertEqual(self.ld.num_syllables("blorptastic"), 3)
+        self.assertEqual((self.ld.oov_cache.hits, self.ld.oov_cache.misses), (1, 1))
+        self.assertEqual(self.ld.num_syllables("hmmph"), 1)
+        self.ld.oov_cache = None
+        self.assertEqual(self.ld.num_syllables("blorptastic"), 1)
+
+    def test_rejected_by(self):
+        self.assertEqual(self.ld.rejected_by(self.ld.my_limerick()), None)
+        self.assertEqual(self.ld.rejected_by("dog\ndog\ndog\ndog"), "line_count")
+        self.assertEqual(self.ld.rejected_by("dog\ndog\ndog\ndog\ndog"), "ab_distinct")
+        self.assertEqual(self.ld.rejected_by("dog\nbog\ncat\nhat\nwashington"), "a_rhyme")
+
+    @unittest.skipIf(numpy is None, "needs numpy")
+    def test_syllable_mask(self):
+        from limerick import syllable_mask
+        counts = [[8, 8, 5, 5, 8],   # fine
+                  [8, 8, 5, 5, 11],  # A lines too far apart
+                  [8, 8, 5, 8, 8],   # B line as long as the A lines
+                  [8, 8, 2, 5, 8],   # B lines too far apart
+                  [1, 1, 1, 1, 1]]   # too short
+        self.assertEqual(list(syllable_mask(counts)), [True, False, False, False, False])
+        self.assertEqual(list(syllable_mask([])), [])
+        self.assertRaises(ValueError, syllable_mask, [[8, 8, 5, 5]] * 5)
+        self.assertRaises(ValueError, syllable_mask, [8, 8, 5, 5, 8])
+
+    @unittest.skipIf(numpy is None, "needs numpy")
+    def test_are_limericks(self):
+        poems = [self.ld.my_limerick(), "dog\ndog\ndog\ndog\ndog", "dog\nbog",
+                 "dog\nbog\ncat\nhat\nwashington"]
+        self.assertEqual(self.ld.are_limericks(poems), [self.ld.is_limerick(poem) for poem in poems])
+        self.assertEqual(self.ld.are_limericks([]), [])
+        # the syllable mask runs before the rhyme rules, so a poem it rejects is never rhyme-checked
+        import copy
+        from limerick import SYLLABLE_RULES, MASK_PREREQUISITES
+        checked = []
+        rules = []
+        for rule in self.ld._rules:
+            rule = copy.copy(rule)
+            if rule.name not in SYLLABLE_RULES + MASK_PREREQUISITES:
+                rule.check = lambda ld, a, b, check=rule.check: checked.append(a) or check(ld, a, b)
+            rules.append(rule)
+        self.ld._rules = rules
+        self.assertEqual(self.ld.are_limericks(["dog\nbog\ncat\nhat\nwashington"]), [False])
+        self.assertEqual(checked, [])
+
+    def test_tokenizers(self):
+        ld = LimerickDetector(tokenizer="nltk")
+        poems = [self.ld.my_limerick(), "dog\ndog\ndog\ndog\ndog",
+                 """An exceedingly fat friend of mine,
+When asked at what hour he'd dine,
+Replied, "At eleven,
+At three, five, and seven,
+And eight and a quarter past nine""",
+                 """There was a young lady one fall
+Who wore a newspaper dress to a ball.
+The dress caught fire
+And burned her entire
+Front page, sporting section and all."""]
+        for poem in poems:
+            a_lines, b_lines = self.ld._get_lines(poem)
+            for line in a_lines + b_lines:
+                self.assertEqual(self.ld._tokenize(line), ld._tokenize(line))
+            self.assertEqual(self.ld.is_limerick(poem), ld.is_limerick(poem))
+        self.assertRaises(ValueError, LimerickDetector, tokenizer="bogus")
+
+    def test_read_poems(self):
+        from limerick import read_poems
+        blank = ["\n", "dog\n", "bog\n", "\n", "\n", "cat\n"]
+        self.assertEqual(list(read_poems(iter(blank), "blank")),
+                         [(0, "dog\nbog\n"), (1, "cat\n")])
+        jsonl = ['{"id": "a", "text": "dog\\nbog"}\n', "\n", '"cat"\n']
+        self.assertEqual(list(read_poems(iter(jsonl), "jsonl")),
+                         [("a", "dog\nbog"), (2, "cat")])
+        bad = ['"dog"\n', "not json\n", '{"id": "b"}\n', '"cat"\n']
+        self.assertRaises(ValueError, list, read_poems(iter(bad), "jsonl"))
+        errors = []
+        self.assertEqual(list(read_poems(iter(bad), "jsonl", errors=errors)), [(0, "dog"), (3, "cat")])
+        self.assertEqual([poem_id for poem_id, message in errors], [1, "b"])
+        self.assertEqual(errors[1][1], "line 3: no poem text")
+
+    def test_classify_stream(self):
+        from limerick import classify_stream
+        infile = ['{"id": "a", "text": %s}\n' % json.dumps(self.ld.my_limerick()), "{\n", '"dog"\n']
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            outfile = prepfile(path, 'w')
+            count, failed, load_seconds, elapsed = classify_stream(self.ld, iter(infile), outfile, "jsonl")
+            outfile.close()
+            self.assertEqual((count, failed), (2, 1))
+            records = [json.loads(line) for line in prepfile(path, 'r')]
+        finally:
+            os.remove(path)
+        self.assertEqual([record["id"] for record in records], ["a", 1, 2])
+        self.assertEqual([sorted(record) for record in records], [["id", "limerick"], ["error", "id"], ["id", "limerick"]])
+
+    def test_scan_limericks(self):
+        from limerick import scan_limericks
+        poem = [line.strip() + "\n" for line in self.ld.my_limerick().split("\n") if line.strip()]
+        text = ["Once upon a time\n", "\n"] + poem + ["The end\n"]
+        self.assertEqual(list(scan_limericks(self.ld, iter(text))), [(3, ''.join(poem))])
+        self.assertEqual(list(scan_limericks(self.ld, iter(poem[:4]))), [])
+
+    def test_classify_poems(self):
+        from limerick import classify_poems
+        poems = [self.ld.my_limerick(), "dog\ndog\ndog\ndog\ndog"] * 5
+        serial = list(classify_poems(self.ld, poems))
+        self.assertEqual(serial, [self.ld.is_limerick(poem) for poem in poems])
+        self.assertEqual(list(classify_poems(self.ld, iter(poems), workers=2, batch_size=3)), serial)
+
+    def test_profile(self):
+        from limerick import classify_poems
+        poems = [self.ld.my_limerick(), "dog\ndog\ndog\ndog\ndog"]
+        with self.ld.profile() as profiler:
+            self.assertEqual([self.ld.is_limerick(poem) for poem in poems], [True, False])
+            self.ld.num_syllables("blorptastic")
+            self.assertEqual(self.ld.rhymes("dog", "bog"), True)
+            self.ld._get_suffix_list("dog")
+        self.assertNotIn("num_syllables", self.ld.__dict__)
+        stats = profiler.stats()
+        self.assertEqual(stats["calls"]["is_limerick"]["calls"], 2)
+        self.assertEqual(stats["calls"]["rule:line_count"]["calls"], 2)
+        self.assertEqual(stats["calls"]["is_limerick"]["buckets"][-1], ["+Inf", 2])
+        self.assertEqual(stats["dictionary"]["syllables"]["misses"], 1)
+        # rhyme tests and table lookups are timed apart from the calls making them
+        self.assertEqual(stats["calls"]["lookup:syllables"]["calls"], stats["dictionary"]["syllables"]["lookups"])
+        self.assertTrue(stats["calls"]["_suffixes_rhyme"]["calls"] > 0)
+        self.assertEqual(stats["calls"]["rhymes"]["calls"], 1)
+        self.assertEqual(stats["calls"]["_get_suffix_list"]["calls"], 1)
+        self.assertTrue(stats["calls"]["lookup:suffixes"]["calls"] > 0)
+        self.assertEqual(type(self.ld._suffixes), type(LimerickDetector()._suffixes))
+        self.assertIn('limerick_call_seconds_count{call="is_limerick"} 2', profiler.to_prometheus())
+        # workers send their counts back to the parent's profiler
+        with self.ld.profile() as pooled:
+            list(classify_poems(self.ld, poems * 3, workers=2, batch_size=2))
+        self.assertEqual(pooled.stats()["calls"]["is_limerick"]["calls"], 6)
+        self.assertEqual(pooled.stats()["dictionary"]["syllables"]["lookups"],
+                         3 * stats["dictionary"]["syllables"]["lookups"] - 3)
+
+    def test_result_cache(self):
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try:
+            self.ld.cache = ResultCache(path, max_entries=2)
+            poem = self.ld.my_limerick()
+            self.assertEqual(self.ld.is_limerick(poem), True)
+            self.assertEqual(self.ld.is_limerick(poem.upper()), True)
+            self.assertEqual(self.ld.rejected_by("dog\ndog\ndog\ndog"), "line_count")
+            self.assertEqual(self.ld.rejected_by("dog\ndog\ndog\ndog"), "line_count")
+            self.assertEqual(self.ld.cache.stats(), {"hits": 2, "misses": 2, "hit_rate": 0.5})
+            self.ld.rejected_by("dog\nbog\ncat\nhat\nwashington")
+            self.ld.cache.evict()
+            self.assertEqual(self.ld.is_limerick(poem), True)
+            self.assertEqual(self.ld.cache.misses, 4)
+            self.ld.cache.close()
+        finally:
+            for suffix in ["", "-wal", "-shm"]:
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+    def test_prepfile(self):
+        workdir = tempfile.mkdtemp()
+        text = u"there was a young man from peru\n" * 5000
+        try:
+            for name in ["plain.txt", "poem.gz", "poem.bz2"]:
+                path = os.path.join(workdir, name)
+                outfile = prepfile(path, 'w')
+                outfile.write(text)
+                outfile.close()
+                self.assertEqual(prepfile(path, 'r').read(), text)
+                # compression is recognized from the contents, not the name
+                os.rename(path, path + ".renamed")
+                self.assertEqual(prepfile(path + ".renamed", 'r').read(), text)
+            # small blocks give a gzip file of many members, which reads back as one stream
+            path = os.path.join(workdir, "members.gz")
+            outfile = ParallelGzipWriter(open(path, 'wb'), threads=2, blocksize=1000)
+            outfile.write(text.encode('utf8'))
+            outfile.close()
+            self.assertEqual(prepfile(path, 'rb').read(), text.encode('utf8'))
+        finally:
+            for name in os.listdir(workdir):
+                os.remove(os.path.join(workdir, name))
+            os.rmdir(workdir)
+
+    def test_shared_fileio(self):
+        # hw1 imports nlp_cmd_exercise's fileio.py through a symlink; a copy would drift
+        here = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(here, "fileio.py"), 'rb') as mine:
+            with open(os.path.join(here, os.pardir, "nlp_cmd_exercise", "fileio.py"), 'rb') as shared:
+                self.assertEqual(mine.read(), shared.read())
+
+    def test_index(self):
+        fd, path = tempfile.mkstemp(suffix=".idx")
+        with os.fdopen(fd, "wb") as fh:
+            compile_index(self.ld._pronunciations, fh)
+        try:
+            ld = LimerickDetector(index=path)
+            for word in ["dog", "washington", "renege", "asdf", "read", "tomato"]:
+                self.assertEqual(ld._pronunciations.get(word), self.ld._pronunciations.get(word))
+                # the mapped index bisects, the in-memory one looks words up in a dict
+                self.assertEqual(ld._syllables.get(word), self.ld._syllables.get(word))
+                self.assertEqual(ld._suffixes.get(word), self.ld._suffixes.get(word))
+            self.assertEqual(sorted(ld._suffixes.items()), sorted(self.ld._suffixes.items()))
+            self.assertEqual(len(ld._pronunciations), len(self.ld._pronunciations))
+            self.assertEqual(ld.rhymes("eleven", "seven"), True)
+            self.assertEqual(ld.rhymes("failure", "savior"), False)
+            self.assertEqual(ld.num_syllables("reluctant"), 3)
+            self.assertEqual(ld.rhyming_words("seven"), self.ld.rhyming_words("seven"))
+        finally:
+            os.remove(path)
+
+    def start_server(self, workers):
+        workdir = tempfile.mkdtemp()
+        path = os.path.join(workdir, "limerickd.sock")
+        server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "limerickd.py"),
+                                   "--socket", path, "--workers", str(workers)])
+        def stop():
+            server.terminate()
+            server.wait()
+            if os.path.exists(path):
+                os.remove(path)
+            os.rmdir(workdir)
+        self.addCleanup(stop)
+        # the socket appears once the dictionary is loaded
+        deadline = time.time() + 120
+        while not os.path.exists(path):
+            self.assertTrue(time.time() < deadline and server.poll() is None, "limerickd.py didn't start")
+            time.sleep(0.1)
+        return path
+
+    def exchange(self, path, payload, responses, closed=False):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        try:
+            try:
+                sock.sendall(payload)
+            except socket.error:
+                # the server hangs up on a request that is too long, maybe before it is all sent
+                pass
+            lines = sock.makefile('rb')
+            replies = [json.loads(lines.readline().decode('utf8')) for i in range(responses)]
+            if closed:
+                self.assertEqual(lines.readline(), b"")
+            return replies
+        finally:
+            sock.close()
+
+    @unittest.skipIf(sys.version_info < (3, 7), "limerickd.py needs python 3.7")
+    def test_daemon(self):
+        from limerickd import MAX_REQUEST
+        poems = [self.ld.my_limerick(), "dog\ndog\ndog\ndog\ndog", "dog\nbog\ncat\nhat\nwashington"]
+        words = ["dog", "washington", "blorptastic"]
+        for workers in (0, 2):
+            path = self.start_server(workers)
+            with LimerickClient(path) as client:
+                requests = ([{"op": "is_limerick", "text": poem} for poem in poems] * 50
+                            + [{"op": "num_syllables", "word": word} for word in words]
+                            + [{"op": "rhymes", "a": "dog", "b": "bog"}, {"op": "rhymes", "a": "dog", "b": "cat"}])
+                expected = ([self.ld.is_limerick(poem) for poem in poems] * 50
+                            + [self.ld.num_syllables(word) for word in words] + [True, False])
+                # more requests than the client's window, so they go in several rounds
+                self.assertEqual(client.pipeline(requests), expected)
+                self.assertEqual(client.rhymes("eleven", "seven"), True)
+                self.assertRaises(LimerickError, client.pipeline, [{"op": "conjugate", "word": "dog"}])
+            # pipelined responses come back in request order, each with its request's id
+            payload = b"".join(json.dumps({"id": i, "op": "is_limerick", "text": poems[i % 3]}).encode('utf8') + b"\n"
+                               for i in range(300))
+            replies = self.exchange(path, payload, 300)
+            self.assertEqual([reply["id"] for reply in replies], list(range(300)))
+            self.assertEqual([reply["result"] for reply in replies], [self.ld.is_limerick(poems[i % 3]) for i in range(300)])
+            # a bad request gets an error in its place, and the connection carries on
+            payload = (b'{"id": "a", "op": "conjugate"}\n{not json\n[1, 2]\n'
+                       b'{"id": "b", "op": "num_syllables"}\n{"id": "c", "op": "num_syllables", "word": "dog"}\n')
+            replies = self.exchange(path, payload, 5)
+            self.assertEqual([reply["id"] for reply in replies], ["a", None, None, "b", "c"])
+            self.assertTrue(all("error" in reply for reply in replies[:4]))
+            self.assertEqual(replies[4]["result"], 1)
+            # an overlong request is refused and the connection closed
+            payload = b'{"id": 1, "op": "num_syllables", "word": "dog"}\n' + b"x" * (MAX_REQUEST + 10) + b"\n"
+            replies = self.exchange(path, payload, 2, closed=True)
+            self.assertEqual(replies[0]["result"], 1)
+            self.assertTrue("longer than" in replies[1]["error"])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
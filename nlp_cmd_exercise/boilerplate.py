@@ -2,7 +2,6 @@
 # boilerplate code by Jon May (jonmay@isi.edu)
 import argparse
 import sys
-import codecs
 if sys.version_info[0] == 2:
   from itertools import izip
 else:
@@ -10,31 +9,15 @@ else:
 from collections import defaultdict as dd
 import re
 import os.path
-import gzip
 import tempfile
 import shutil
 import atexit
 
-scriptdir = os.path.dirname(os.path.abspath(__file__))
-
+from fileio import prepfile
 
-reader = codecs.getreader('utf8')
-writer = codecs.getwriter('utf8')
 
+scriptdir = os.path.dirname(os.path.abspath(__file__))
 
-def prepfile(fh, code):
-  if type(fh) is str:
-    fh = open(fh, code)
-  ret = gzip.open(fh.name, code if code.endswith("t") else code+"t") if fh.name.endswith(".gz") else fh
-  if sys.version_info[0] == 2:
-    if code.startswith('r'):
-      ret = reader(fh)
-    elif code.startswith('w'):
-      ret = writer(fh)
-    else:
-      sys.stderr.write("I didn't understand code "+code+"\n")
-      sys.exit(1)
-  return ret
 
 def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
   ''' add the switches --arg and --no-arg that set parser.arg to true/false, respectively'''
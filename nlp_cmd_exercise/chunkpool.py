@@ -0,0 +1,34 @@
+# running a function over chunks of lines in a pool of worker processes, shared by tok.py and simplesent.py
+from collections import deque
+from itertools import islice
+
+
+def chunked(lines, size):
+  ''' yield lists of up to size consecutive lines'''
+  return iter(lambda: list(islice(lines, size)), [])
+
+def map_chunks(fn, chunks, args=(), workers=1, initializer=None, initargs=()):
+  ''' yield fn(chunk, *args) for each of chunks, in order, computed in a pool of workers processes (or in this one if
+  workers is at most 1). initializer(*initargs) sets up each process that calls fn, so workers get their state
+  whether they are forked or spawned'''
+  if workers <= 1:
+    if initializer is not None:
+      initializer(*initargs)
+    for chunk in chunks:
+      yield fn(chunk, *args)
+    return
+  import multiprocessing
+  pool = multiprocessing.Pool(workers, initializer, initargs)
+  try:
+    # keep two chunks per worker in flight so the input is read no further ahead than that
+    pending = deque()
+    for chunk in chunks:
+      pending.append(pool.apply_async(fn, (chunk,) + tuple(args)))
+      if len(pending) >= 2 * workers:
+        yield pending.popleft().get()
+    while pending:
+      yield pending.popleft().get()
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
@@ -9,32 +9,20 @@ else:
 from collections import defaultdict as dd
 import re
 import os.path
-import gzip
 import tempfile
 import shutil
 import atexit
-from bs4 import BeautifulSoup as bs
-
-scriptdir = os.path.dirname(os.path.abspath(__file__))
+from collections import deque
+if sys.version_info[0] == 2:
+  from HTMLParser import HTMLParser
+else:
+  from html.parser import HTMLParser
 
+from fileio import prepfile
 
-reader = codecs.getreader('utf8')
-writer = codecs.getwriter('utf8')
 
+scriptdir = os.path.dirname(os.path.abspath(__file__))
 
-def prepfile(fh, code):
-  if type(fh) is str:
-    fh = open(fh, code)
-  ret = gzip.open(fh.name, code if code.endswith("t") else code+"t") if fh.name.endswith(".gz") else fh
-  if sys.version_info[0] == 2:
-    if code.startswith('r'):
-      ret = reader(fh)
-    elif code.startswith('w'):
-      ret = writer(fh)
-    else:
-      sys.stderr.write("I didn't understand code "+code+"\n")
-      sys.exit(1)
-  return ret
 
 def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
   ''' add the switches --arg and --no-arg that set parser.arg to true/false, respectively'''
@@ -43,12 +31,73 @@ def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
   group.add_argument('--%s' % arg, dest=dest, action='store_true', default=default, help=help)
   group.add_argument('--no-%s' % arg, dest=dest, action='store_false', default=default, help="See --%s" % arg)
 
+class ReviewTextParser(HTMLParser):
+  ''' incremental parser that collects the text of each element named tag as soon as it closes, keeping nothing else'''
+  def __init__(self, tag='review_text'):
+    if sys.version_info[0] == 2:
+      HTMLParser.__init__(self)
+    else:
+      HTMLParser.__init__(self, convert_charrefs=True)
+    self.tag = tag
+    self.depth = 0
+    self.text = []
+    self.found = deque()
+
+  def handle_starttag(self, tag, attrs):
+    if tag == self.tag:
+      self.depth += 1
+
+  def handle_endtag(self, tag):
+    if tag == self.tag and self.depth > 0:
+      self.depth -= 1
+      if self.depth == 0:
+        self.found.append(''.join(self.text))
+        self.text = []
+
+  def handle_data(self, data):
+    if self.depth > 0:
+      self.text.append(data)
+
+  # only used on python 2, where character references aren't converted for us
+  def handle_entityref(self, name):
+    self.handle_data(self.unescape("&%s;" % name))
+
+  def handle_charref(self, name):
+    self.handle_data(self.unescape("&#%s;" % name))
+
+def review_text(blocks):
+  ''' yield the text of each review_text element in blocks, an iterable of byte strings, as soon as it has been read'''
+  decoder = codecs.getincrementaldecoder('utf8')('replace')
+  parser = ReviewTextParser()
+  for block in blocks:
+    parser.feed(decoder.decode(block))
+    while parser.found:
+      yield parser.found.popleft()
+  parser.feed(decoder.decode(b'', final=True))
+  parser.close()
+  while parser.found:
+    yield parser.found.popleft()
+
+def stream_review_text(infile, blocksize=1 << 16):
+  ''' yield the text of each review_text element in the byte stream infile as soon as it has been read'''
+  infile = getattr(infile, 'buffer', infile) # stdin is opened as text
+  return review_text(iter(lambda: infile.read(blocksize), b''))
+
+def review_lines(texts):
+  ''' yield the non-empty lines of each of texts'''
+  for text in texts:
+    for subline in text.split('\n'):
+      if len(subline) > 0:
+        yield subline
+
 def main():
   parser = argparse.ArgumentParser(description="extract review text with bs",
                                    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
   addonoffarg(parser, 'debug', help="debug mode", default=False)
   parser.add_argument("--infile", "-i", nargs='?', type=argparse.FileType('rb'), default=sys.stdin, help="input file")
   parser.add_argument("--outfile", "-o", nargs='?', type=argparse.FileType('w'), default=sys.stdout, help="output file")
+  addonoffarg(parser, 'corpus', help="write a binary token corpus (see tokcorpus.py), each line split on whitespace, for simplesent.py --corpus instead of text", default=False)
+  addonoffarg(parser, 'stream', help="parse incrementally, writing each review as soon as it is read, instead of building the whole document with bs", default=False)
 
 
 
@@ -69,14 +118,24 @@ def main():
 
 
   infile = prepfile(args.infile, 'rb')
-  outfile = prepfile(args.outfile, 'w')
+  if args.corpus:
+    from tokcorpus import CorpusWriter
+    outfile = CorpusWriter(prepfile(args.outfile, 'wb'))
+    write = lambda subline: outfile.write(subline.split())
+  else:
+    outfile = prepfile(args.outfile, 'w')
+    write = lambda subline: outfile.write(subline+"\n")
 
   # MEANINGFUL PART
-  soup = bs(infile, "lxml")
-  for line in soup.find_all('review_text'):
-      for subline in line.text.split('\n'):
-          if len(subline) > 0:
-              outfile.write(subline+"\n")
+  if args.stream:
+    texts = stream_review_text(infile)
+  else:
+    from bs4 import BeautifulSoup as bs
+    soup = bs(infile, "lxml")
+    texts = (line.text for line in soup.find_all('review_text'))
+  for subline in review_lines(texts):
+    write(subline)
+  outfile.close()
 
 if __name__ == '__main__':
   main()
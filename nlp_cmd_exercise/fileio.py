@@ -0,0 +1,232 @@
+# file handling shared by the command line scripts: prepfile opens inputs and
+# outputs with large buffers, (de)compressing gzip, bz2 and xz on the fly.
+# hw1/fileio.py is a symlink to this file, so both directories import one copy
+import sys
+import io
+import os
+import gzip
+import bz2
+import zlib
+import codecs
+import threading
+from collections import deque
+if sys.version_info[0] == 2:
+  import Queue as queue
+else:
+  import queue
+try:
+  import lzma
+except ImportError:
+  lzma = None
+
+
+reader = codecs.getreader('utf8')
+writer = codecs.getwriter('utf8')
+
+# bytes read from or written to disk at a time
+BUFSIZE = 1 << 20
+# uncompressed bytes in each gzip member ParallelGzipWriter writes
+BLOCKSIZE = 1 << 20
+# decompressed blocks read ahead of the reader
+READAHEAD = 4
+
+# compression formats by leading bytes, for reading, and by file extension, for writing
+MAGIC = ((b'\x1f\x8b', 'gz'), (b'BZh', 'bz2'), (b'\xfd7zXZ\x00', 'xz'))
+EXTENSIONS = {'.gz': 'gz', '.bz2': 'bz2', '.xz': 'xz'}
+
+
+def _compress_member(data, level):
+  # wbits 31 writes a gzip header and trailer around the deflate stream
+  compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+  return compressor.compress(data) + compressor.flush()
+
+
+class ParallelGzipWriter(io.BufferedIOBase):
+  """
+  Writes a gzip file the way pigz does: the data is cut into blocks that are
+  compressed in a pool of threads (zlib releases the GIL) and written, in
+  order, as consecutive gzip members. gzip, zcat and gzip.open read the result
+  as one stream. Closing the writer closes fh.
+  """
+
+  def __init__(self, fh, threads=None, blocksize=BLOCKSIZE, level=6):
+    # the thread pool takes a while to import, and most runs never write gzip
+    import multiprocessing
+    from multiprocessing.pool import ThreadPool
+    self._fh = fh
+    self._threads = threads or multiprocessing.cpu_count()
+    self._blocksize = blocksize
+    self._level = level
+    self._buffer = bytearray()
+    self._pending = deque()
+    self._pool = ThreadPool(self._threads)
+
+  def writable(self):
+    return True
+
+  def write(self, data):
+    if self.closed:
+      raise ValueError("write to closed file")
+    self._buffer.extend(data)
+    while len(self._buffer) >= self._blocksize:
+      self._submit(bytes(self._buffer[:self._blocksize]))
+      del self._buffer[:self._blocksize]
+    return len(data)
+
+  def _submit(self, block):
+    self._pending.append(self._pool.apply_async(_compress_member, (block, self._level)))
+    # two blocks per thread in flight keep the threads busy without holding the whole output
+    while len(self._pending) > 2 * self._threads:
+      self._fh.write(self._pending.popleft().get())
+
+  def flush(self):
+    """
+    Compress whatever has been written so far, ending the current member.
+    """
+    if self._buffer:
+      self._submit(bytes(self._buffer))
+      del self._buffer[:]
+    while self._pending:
+      self._fh.write(self._pending.popleft().get())
+    self._fh.flush()
+
+  def close(self):
+    if self.closed:
+      return
+    try:
+      # flushes the last block
+      io.BufferedIOBase.close(self)
+    finally:
+      self._pool.close()
+      self._pool.join()
+      self._fh.close()
+
+
+class _ReadAhead(io.RawIOBase):
+  """
+  Reads fh (a decompressing file) in a background thread, keeping up to
+  READAHEAD blocks ready, so decompression overlaps with the reader's work.
+  """
+
+  def __init__(self, fh):
+    self._fh = fh
+    self._blocks = queue.Queue(READAHEAD)
+    self._block = b''
+    self._offset = 0
+    self._eof = False
+    thread = threading.Thread(target=self._fill)
+    thread.daemon = True
+    thread.start()
+
+  def _fill(self):
+    try:
+      while True:
+        block = self._fh.read(BUFSIZE)
+        self._blocks.put(block)
+        if not block:
+          break
+    except Exception as error:
+      self._blocks.put(error)
+
+  def readable(self):
+    return True
+
+  def readinto(self, b):
+    if self._offset == len(self._block):
+      if self._eof:
+        return 0
+      block = self._blocks.get()
+      if isinstance(block, Exception):
+        raise block
+      if not block:
+        self._eof = True
+        return 0
+      self._block, self._offset = block, 0
+    size = min(len(b), len(self._block) - self._offset)
+    b[:size] = self._block[self._offset:self._offset + size]
+    self._offset += size
+    return size
+
+
+def _binary(fh, mode):
+  """
+  Return a binary file with a large buffer for fh, a file name or an open
+  file, and the name to guess its compression from. An open file is read or
+  written through a duplicate of its descriptor, so standard input and output
+  get large buffers too.
+  """
+  if isinstance(fh, str):
+    return io.open(fh, mode+'b', buffering=BUFSIZE), fh
+  name = getattr(fh, 'name', '')
+  name = name if isinstance(name, str) else ''
+  try:
+    fileno = fh.fileno()
+  except (AttributeError, io.UnsupportedOperation):
+    return getattr(fh, 'buffer', None), name
+  if mode == 'w':
+    fh.flush()
+  return io.open(os.dup(fileno), mode+'b', buffering=BUFSIZE), name
+
+def _format(binary, name, mode):
+  if mode == 'r':
+    head = binary.peek(6)[:6]
+    for magic, fmt in MAGIC:
+      if head.startswith(magic):
+        return fmt
+    return None
+  return EXTENSIONS.get(os.path.splitext(name)[1])
+
+def _bz2(binary, name, mode):
+  if sys.version_info[0] > 2:
+    return bz2.BZ2File(binary, mode+'b')
+  # python 2's BZ2File only opens files by name
+  if not os.path.isfile(name):
+    raise ValueError("python 2 can only read and write bz2 files by name")
+  binary.close()
+  return bz2.BZ2File(name, mode+'b')
+
+def _decompress(binary, name, fmt):
+  if fmt == 'gz':
+    return gzip.GzipFile(fileobj=binary, mode='rb')
+  if fmt == 'bz2':
+    return _bz2(binary, name, 'r')
+  if fmt == 'xz' and lzma is not None:
+    return lzma.LZMAFile(binary, 'rb')
+  raise ValueError("can't read %s files with this python" % fmt)
+
+def _compress(binary, name, fmt):
+  if fmt == 'gz':
+    return ParallelGzipWriter(binary)
+  if fmt == 'bz2':
+    return _bz2(binary, name, 'w')
+  if fmt == 'xz' and lzma is not None:
+    return lzma.LZMAFile(binary, 'wb')
+  raise ValueError("can't write %s files with this python" % fmt)
+
+def prepfile(fh, code):
+  """
+  Open fh, a file name or an open file, for reading (code 'r' or 'rb') or
+  writing ('w' or 'wb'). Input compressed with gzip, bz2 or xz is recognized
+  by its first bytes and decompressed in a background thread; output named
+  .gz, .bz2 or .xz is compressed, gzip by ParallelGzipWriter. Returns a binary
+  file for 'rb' and 'wb', and otherwise a utf8 text file.
+  """
+  mode = code[0]
+  if mode not in 'rw':
+    sys.stderr.write("I didn't understand code "+code+"\n")
+    sys.exit(1)
+  binary, name = _binary(fh, mode)
+  if binary is None:
+    # an in-memory text file: nothing to decompress or re-buffer
+    return fh
+  fmt = _format(binary, name, mode)
+  if fmt is not None and mode == 'r':
+    binary = io.BufferedReader(_ReadAhead(_decompress(binary, name, fmt)), BUFSIZE)
+  elif fmt is not None:
+    binary = _compress(binary, name, fmt)
+  if code.endswith('b'):
+    return binary
+  if sys.version_info[0] == 2:
+    return reader(binary) if mode == 'r' else writer(binary)
+  # flush each line to a terminal, so interactive output is not held back by the big buffer
+  return io.TextIOWrapper(binary, encoding='utf8', line_buffering=mode == 'w' and binary.isatty())
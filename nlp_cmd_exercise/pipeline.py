@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# run extract.py, tok.py and simplesent.py as stages of one program, connected by bounded queues
+import argparse
+import sys
+if sys.version_info[0] == 2:
+  from itertools import izip
+  import Queue as queue
+else:
+  izip = zip
+  import queue
+import os.path
+import json
+import time
+import threading
+import traceback
+
+from fileio import prepfile
+from extract import review_text, review_lines
+from tok import tokenize
+from simplesent import load_lexicon
+
+
+scriptdir = os.path.dirname(os.path.abspath(__file__))
+
+
+def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
+  ''' add the switches --arg and --no-arg that set parser.arg to true/false, respectively'''
+  group = parser.add_mutually_exclusive_group()
+  dest = arg if dest is None else dest
+  group.add_argument('--%s' % arg, dest=dest, action='store_true', default=default, help=help)
+  group.add_argument('--no-%s' % arg, dest=dest, action='store_false', default=default, help="See --%s" % arg)
+
+
+class PipelineError(Exception):
+  ''' a stage of a pipeline raised an exception; the message names the stage and holds its traceback'''
+
+
+class Stage(object):
+  ''' a named step of a pipeline: fn takes an iterator of items and yields items'''
+  def __init__(self, name, fn):
+    self.name = name
+    self.fn = fn
+
+
+# messages between stages: a batch of items, or the end of the input, which
+# carries the counters of every stage so far and the error that ended it, if any
+_BATCH, _END = 0, 1
+# seconds between checks for a stopped pipeline while blocked on a queue
+_POLL = 0.1
+
+class _Stopped(Exception):
+  pass
+
+class _Failed(Exception):
+  pass
+
+def _counters(name):
+  return {"stage": name, "items_in": 0, "items_out": 0, "busy_s": 0.0, "wait_in_s": 0.0, "wait_out_s": 0.0}
+
+def _put(box, message, stop):
+  while not stop.is_set():
+    try:
+      box.put(message, timeout=_POLL)
+      return
+    except queue.Full:
+      pass
+  raise _Stopped()
+
+def _get(box, stop):
+  while not stop.is_set():
+    try:
+      return box.get(timeout=_POLL)
+    except queue.Empty:
+      pass
+  raise _Stopped()
+
+def _abandon(outbox):
+  # a process exits only once what it put on a multiprocessing queue has been read, unless told not to wait
+  if hasattr(outbox, "cancel_join_thread"):
+    outbox.cancel_join_thread()
+
+def _receive(inbox, stop, counters, finished):
+  ''' yield the items arriving on inbox, adding the counters of the stages before to finished when they end'''
+  while True:
+    waited = time.time()
+    kind, payload = _get(inbox, stop)
+    counters["wait_in_s"] += time.time() - waited
+    if kind == _END:
+      stats, error = payload
+      finished.extend(stats)
+      if error is not None:
+        raise _Failed(error)
+      return
+    counters["items_in"] += len(payload)
+    for item in payload:
+      yield item
+
+def _work(stage, inbox, outbox, stop, batch_size):
+  ''' run stage on the items from inbox (or on nothing, for the source), sending its output to outbox in batches'''
+  counters = _counters(stage.name)
+  finished = []
+  error = None
+  start = time.time()
+
+  def send(batch):
+    waited = time.time()
+    _put(outbox, (_BATCH, batch), stop)
+    counters["wait_out_s"] += time.time() - waited
+    counters["items_out"] += len(batch)
+
+  try:
+    batch = []
+    for item in stage.fn(iter(()) if inbox is None else _receive(inbox, stop, counters, finished)):
+      batch.append(item)
+      if len(batch) >= batch_size:
+        send(batch)
+        batch = []
+    if batch:
+      send(batch)
+  except _Stopped:
+    _abandon(outbox)
+    return
+  except _Failed as failure:
+    # an earlier stage failed; pass its error on without running this one any further
+    error = failure.args[0]
+  except Exception:
+    error = "stage %s failed:\n%s" % (stage.name, traceback.format_exc())
+  counters["busy_s"] = time.time() - start - counters["wait_in_s"] - counters["wait_out_s"]
+  try:
+    _put(outbox, (_END, (finished + [counters], error)), stop)
+  except _Stopped:
+    _abandon(outbox)
+
+def _timed(stage, items, counters):
+  ''' yield the output of stage on items, adding up the time spent producing it (including every stage before) in
+  counters. A failure of the stage is raised as a PipelineError, and one from a stage before passed on as it is'''
+  start = time.time()
+  try:
+    items = iter(stage.fn(items))
+    while True:
+      try:
+        item = next(items)
+      except StopIteration:
+        counters["busy_s"] += time.time() - start
+        return
+      counters["busy_s"] += time.time() - start
+      counters["items_out"] += 1
+      yield item
+      start = time.time()
+  except PipelineError:
+    raise
+  except Exception:
+    raise PipelineError("stage %s failed:\n%s" % (stage.name, traceback.format_exc()))
+
+
+class Pipeline(object):
+  ''' runs a source and a list of Stages, each stage consuming the output of the one before. In "inline" mode the
+  stages are generators chained in the calling thread; in "thread" and "process" mode each stage runs in its own
+  thread or forked process (the source always in a thread), passing batches of batch_size items through queues
+  that hold at most queue_size batches, so a fast stage blocks rather than running ahead of a slow one. Threads
+  overlap I/O with compute (nltk and the classifier hold the GIL); processes also overlap compute, at the cost of
+  pickling every batch. After a run, stats holds each stage's item counts and seconds busy, waiting for input
+  (wait_in_s) and blocked on a full queue (wait_out_s).'''
+
+  def __init__(self, stages, mode="thread", queue_size=8, batch_size=1000):
+    if mode not in ("inline", "thread", "process"):
+      raise ValueError("unknown pipeline mode: %r" % mode)
+    self.stages = stages
+    self.mode = mode
+    self.queue_size = queue_size
+    self.batch_size = batch_size
+    self.stats = []
+
+  def run(self, source):
+    ''' yield the output of the last stage for the items of source'''
+    stages = [Stage("source", lambda items: source)] + list(self.stages)
+    if self.mode == "inline":
+      return self._inline(stages)
+    return self._concurrent(stages)
+
+  def _inline(self, stages):
+    counters = [_counters(stage.name) for stage in stages]
+    items = iter(())
+    for stage, count in izip(stages, counters):
+      items = _timed(stage, items, count)
+    for item in items:
+      yield item
+    # each stage's time includes the stages feeding it
+    for before, after in reversed(list(izip(counters, counters[1:]))):
+      after["items_in"] = before["items_out"]
+      after["busy_s"] -= before["busy_s"]
+    self.stats = counters
+
+  def _concurrent(self, stages):
+    if self.mode == "process":
+      import multiprocessing
+      # forked workers inherit the stages, so their functions needn't be picklable
+      context = multiprocessing.get_context("fork") if hasattr(multiprocessing, "get_context") else multiprocessing
+      Queue, Worker, stop = context.Queue, context.Process, context.Event()
+    else:
+      Queue, Worker, stop = queue.Queue, threading.Thread, threading.Event()
+    boxes = [None] + [Queue(self.queue_size) for stage in stages]
+    workers = [Worker(target=_work, args=(stage, inbox, outbox, stop, self.batch_size))
+               for stage, inbox, outbox in izip(stages[1:], boxes[1:], boxes[2:])]
+    # the source runs in a thread of this process in either mode, started after the forks: a forked copy of the
+    # input can stop short, e.g. a compressed file whose decompressing thread isn't forked with it
+    workers.append(threading.Thread(target=_work, args=(stages[0], None, boxes[1], stop, self.batch_size)))
+    for worker in workers:
+      worker.daemon = True
+      worker.start()
+    finished = []
+    try:
+      for item in _receive(boxes[-1], stop, _counters("output"), finished):
+        yield item
+    except _Failed as failure:
+      raise PipelineError(failure.args[0])
+    finally:
+      self.stats = finished
+      stop.set()
+      for worker in workers:
+        worker.join()
+
+
+def read_blocks(infile, blocksize=1 << 16):
+  ''' yield the binary file infile in blocks of blocksize bytes'''
+  infile = getattr(infile, 'buffer', infile) # stdin is opened as text
+  return iter(lambda: infile.read(blocksize), b'')
+
+def extract_stage(blocks):
+  ''' yield the non-empty lines of each review in blocks of review file bytes, as extract.py --stream does'''
+  return review_lines(review_text(blocks))
+
+def tokenize_stage(lines, chunk_size=1000):
+  ''' yield each of lines tokenized by nltk, as tok.py does'''
+  for block in tokenize(lines, chunk_size=chunk_size, join=False):
+    for tokens in block:
+      yield tokens
+
+def split_stage(lines):
+  ''' yield each of lines split on whitespace'''
+  for line in lines:
+    yield line.split()
+
+def classify_stage(lexicon, default):
+  ''' return a stage function labelling token lists with lexicon, as simplesent.py does'''
+  def classify(tokens):
+    for words in tokens:
+      yield lexicon.classify_words([word.lower() for word in words], default)
+  return classify
+
+def review_pipeline(lexicon, default="pos", tokenizer="nltk", **options):
+  ''' return a Pipeline that labels the lines of a review file read as blocks, like extract.py --stream | tok.py | simplesent.py'''
+  return Pipeline([Stage("extract", extract_stage),
+                   Stage("tokenize", tokenize_stage if tokenizer == "nltk" else split_stage),
+                   Stage("classify", classify_stage(lexicon, default))], **options)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="label each review line pos or neg in one program, as extract.py --stream | tok.py | simplesent.py would",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  addonoffarg(parser, 'debug', help="debug mode", default=False)
+  parser.add_argument("--infile", "-i", nargs='?', type=argparse.FileType('rb'), default=sys.stdin, help="review file")
+  parser.add_argument("--posfile", "-p", nargs='?', type=argparse.FileType('r'), default=sys.stdin, help="pos file: one entry per line, optionally followed by a tab and a weight")
+  parser.add_argument("--negfile", "-n", nargs='?', type=argparse.FileType('r'), default=sys.stdin, help="neg file: one entry per line, optionally followed by a tab and a weight")
+  parser.add_argument("--outfile", "-o", nargs='?', type=argparse.FileType('w'), default=sys.stdout, help="output file")
+  parser.add_argument("--default", default="pos", help="default category")
+  parser.add_argument("--lexicon-cache", default=None, help="file to keep the compiled pos and neg lexicons in, rebuilt when either changes")
+  parser.add_argument("--tokenizer", choices=["nltk", "split"], default="nltk", help="word splitter: nltk's word_tokenize, as tok.py, or whitespace")
+  parser.add_argument("--mode", choices=["inline", "thread", "process"], default="thread", help="run the stages as chained generators, or each in a thread or a process")
+  parser.add_argument("--queue-size", type=int, default=8, help="batches each queue between stages holds before the stage feeding it blocks")
+  parser.add_argument("--batch-size", type=int, default=1000, help="items passed between stages at a time")
+  addonoffarg(parser, 'stats', help="write each stage's counters to stderr as json when done", default=False)
+
+  try:
+    args = parser.parse_args()
+  except IOError as msg:
+    parser.error(str(msg))
+
+  infile = prepfile(args.infile, 'rb')
+  outfile = prepfile(args.outfile, 'w')
+
+  lexicon = load_lexicon(args.posfile, args.negfile, cache=args.lexicon_cache)
+  pipeline = review_pipeline(lexicon, default=args.default, tokenizer=args.tokenizer, mode=args.mode,
+                             queue_size=args.queue_size, batch_size=args.batch_size)
+  start = time.time()
+  for label in pipeline.run(read_blocks(infile)):
+    outfile.write(label+"\n")
+  outfile.close()
+  if args.stats:
+    sys.stderr.write(json.dumps({"wall_s": time.time() - start, "stages": pipeline.stats}, indent=2, sort_keys=True)+"\n")
+
+if __name__ == '__main__':
+  main()
@@ -5,7 +5,6 @@
 
 import argparse
 import sys
-import codecs
 if sys.version_info[0] == 2:
   from itertools import izip
 else:
@@ -13,31 +12,21 @@ else:
 from collections import defaultdict as dd
 import re
 import os.path
-import gzip
 import tempfile
 import shutil
 import atexit
+import json
+import time
+import pickle
+import hashlib
+import random
 
-scriptdir = os.path.dirname(os.path.abspath(__file__))
-
+from fileio import prepfile
+from chunkpool import chunked, map_chunks
 
-reader = codecs.getreader('utf8')
-writer = codecs.getwriter('utf8')
 
+scriptdir = os.path.dirname(os.path.abspath(__file__))
 
-def prepfile(fh, code):
-  if type(fh) is str:
-    fh = open(fh, code)
-  ret = gzip.open(fh.name, code if code.endswith("t") else code+"t") if fh.name.endswith(".gz") else fh
-  if sys.version_info[0] == 2:
-    if code.startswith('r'):
-      ret = reader(fh)
-    elif code.startswith('w'):
-      ret = writer(fh)
-    else:
-      sys.stderr.write("I didn't understand code "+code+"\n")
-      sys.exit(1)
-  return ret
 
 def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
   ''' add the switches --arg and --no-arg that set parser.arg to true/false, respectively'''
@@ -46,15 +35,205 @@ def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
   group.add_argument('--%s' % arg, dest=dest, action='store_true', default=default, help=help)
   group.add_argument('--no-%s' % arg, dest=dest, action='store_false', default=default, help="See --%s" % arg)
 
+POSITIVE = 1
+NEGATIVE = -1
+
+class Lexicon(object):
+  ''' pos and neg lexicon entries, possibly several words long, mapped to signed weights. Kept as two flat
+  dicts rather than a tree of nodes, so a big lexicon is quick to unpickle and holds nothing the collector tracks'''
+  def __init__(self, weights=None, spans=None):
+    # entry (its tokens joined by single spaces) -> weight
+    self.weights = {} if weights is None else weights
+    # first token of each entry -> length in tokens of the longest entry starting with it
+    self.spans = {} if spans is None else spans
+
+  def add(self, entry, weight):
+    ''' add entry with weight, unless it is already in the lexicon (so the first list loaded wins)'''
+    tokens = entry.lower().split()
+    if not tokens:
+      return
+    key = ' '.join(tokens)
+    if key in self.weights:
+      return
+    self.weights[key] = weight
+    if len(tokens) > self.spans.get(tokens[0], 0):
+      self.spans[tokens[0]] = len(tokens)
+
+  def load(self, fh, polarity):
+    ''' add the entries in fh, one per line, optionally followed by a tab and a weight (default 1), signed by polarity'''
+    for line in fh:
+      entry, tab, weight = line.strip().partition("\t")
+      self.add(entry, polarity * (float(weight) if tab else 1))
+
+  def score(self, words):
+    ''' return the sum of the weights of the entries in words, matching the longest entry at each position and skipping past it'''
+    total = 0
+    weights = self.weights
+    spans = self.spans
+    i = 0
+    n = len(words)
+    while i < n:
+      span = spans.get(words[i])
+      if span is None:
+        i += 1
+        continue
+      length = 1
+      weight = weights.get(words[i])
+      if span > 1:
+        for k in range(min(span, n - i), 1, -1):
+          phrase = weights.get(' '.join(words[i:i+k]))
+          if phrase is not None:
+            weight, length = phrase, k
+            break
+      if weight is not None:
+        total += weight
+      i += length
+    return total
+
+  def classify(self, line, default):
+    return self.classify_words(line.lower().split(), default)
+
+  def classify_words(self, words, default):
+    ''' label a line already split into lowercased words'''
+    score = self.score(words)
+    if score > 0:
+      return "pos"
+    elif score < 0:
+      return "neg"
+    return default
+
+def _digest(path):
+  digest = hashlib.sha1()
+  with open(path, 'rb') as fh:
+    for block in iter(lambda: fh.read(1 << 20), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+def _source(path):
+  stat = os.stat(path)
+  return (path, stat.st_mtime, stat.st_size, _digest(path))
+
+def _current(source):
+  ''' return the record of the file a cache was built from as it is now, or None if its contents have changed'''
+  path, mtime, size, digest = source
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return None
+  if (stat.st_mtime, stat.st_size) == (mtime, size):
+    return source
+  # touched but maybe not edited: only the contents count
+  if stat.st_size == size and _digest(path) == digest:
+    return (path, stat.st_mtime, stat.st_size, digest)
+  return None
+
+def _read_cache(cache, paths):
+  ''' return the Lexicon pickled in cache if it was built from paths as they are now, else None'''
+  try:
+    with open(cache, 'rb') as fh:
+      sources, weights, spans = pickle.load(fh)
+  except Exception:
+    # unpickling a damaged file can raise almost anything (KeyError, IndexError, ...); rebuild it
+    return None
+  if [source[0] for source in sources] != paths:
+    return None
+  current = [_current(source) for source in sources]
+  if None in current:
+    return None
+  lexicon = Lexicon(weights, spans)
+  if current != list(sources):
+    # record the new times, so the touched files aren't hashed again on every load
+    try:
+      _write_cache(cache, current, lexicon)
+    except (OSError, IOError):
+      pass
+  return lexicon
+
+def _write_cache(cache, sources, lexicon):
+  # write to a temporary file and rename it so readers never see half a cache
+  fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache)))
+  with os.fdopen(fd, 'wb') as fh:
+    pickle.dump((sources, lexicon.weights, lexicon.spans), fh, pickle.HIGHEST_PROTOCOL)
+  os.rename(tmp, cache)
+
+def load_lexicon(posfile, negfile, cache=None):
+  ''' return the Lexicon of posfile and negfile. If cache names a file, the lexicon is pickled there and
+  reloaded from it while the mtime, size and hash of both lexicon files still match'''
+  paths = [os.path.abspath(fh.name) for fh in (posfile, negfile)]
+  if cache is not None and not all(os.path.isfile(path) for path in paths):
+    cache = None
+  if cache is not None and os.path.exists(cache):
+    lexicon = _read_cache(cache, paths)
+    if lexicon is not None:
+      return lexicon
+  # positive entries are loaded first, so they win over the same entry in the negative list
+  lexicon = Lexicon()
+  lexicon.load(prepfile(posfile, 'r'), POSITIVE)
+  lexicon.load(prepfile(negfile, 'r'), NEGATIVE)
+  if cache is not None:
+    _write_cache(cache, [_source(path) for path in paths], lexicon)
+  return lexicon
+
+# the lexicon and default category used by classify_chunk; set in each process that runs it by _set_lexicon
+_lexicon = None
+_default = None
+
+def _set_lexicon(lexicon, default):
+  global _lexicon, _default
+  _lexicon, _default = lexicon, default
+
+def classify_chunk(lines, tokenized=False):
+  ''' classify each of lines (or if tokenized, lists of lowercased words), returning the labels as one block of text, a line per input line'''
+  if tokenized:
+    return ''.join([_lexicon.classify_words(words, _default)+"\n" for words in lines])
+  return ''.join([_lexicon.classify(line, _default)+"\n" for line in lines])
+
+def classify(lexicon, infile, default, workers=1, chunk_size=10000, tokenized=False):
+  ''' yield blocks of labels for infile (lines, or if tokenized, lists of lowercased words) in order, classifying chunk_size lines at a time in a pool of workers processes'''
+  return map_chunks(classify_chunk, chunked(infile, chunk_size), (tokenized,), workers,
+                    initializer=_set_lexicon, initargs=(lexicon, default))
+
+# words that carry no polarity, to pad out synthetic reviews
+FILLER = ("the a an and but it this that i my was is of to for with on in very "
+          "product item bought price shipping day time use works would again").split()
+
+def synthetic_reviews(lexicon, count, seed=544):
+  ''' return count reproducible review-like lines mixing lexicon entries into filler words'''
+  entries = sorted(lexicon.weights)
+  rand = random.Random(seed)
+  lines = []
+  for i in range(count):
+    words = [rand.choice(FILLER) for j in range(rand.randint(10, 80))]
+    for j in range(rand.randint(0, 4)):
+      words.insert(rand.randint(0, len(words)), rand.choice(entries).capitalize())
+    lines.append(' '.join(words)+"\n")
+  return lines
+
+def benchmark(lexicon, count, workers, chunk_size):
+  ''' time classifying count synthetic reviews serially and with workers processes'''
+  lines = synthetic_reviews(lexicon, count)
+  results = {"lines": count, "workers": workers, "chunk_size": chunk_size}
+  for name, n in (("serial", 1), ("pool", workers)):
+    start = time.time()
+    for block in classify(lexicon, iter(lines), "pos", workers=n, chunk_size=chunk_size):
+      pass
+    results[name+"_lines_per_sec"] = count / (time.time() - start)
+  return results
+
 def main():
   parser = argparse.ArgumentParser(description="classify a sentence based on if it has more positive or negative words",
                                    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
   addonoffarg(parser, 'debug', help="debug mode", default=False)
   parser.add_argument("--infile", "-i", nargs='?', type=argparse.FileType('r'), default=sys.stdin, help="input file")
-  parser.add_argument("--posfile", "-p", nargs='?', type=argparse.FileType('r'), default=sys.stdin, help="pos file")
-  parser.add_argument("--negfile", "-n", nargs='?', type=argparse.FileType('r'), default=sys.stdin, help="neg file")
+  parser.add_argument("--posfile", "-p", nargs='?', type=argparse.FileType('r'), default=sys.stdin, help="pos file: one entry per line, optionally followed by a tab and a weight")
+  parser.add_argument("--negfile", "-n", nargs='?', type=argparse.FileType('r'), default=sys.stdin, help="neg file: one entry per line, optionally followed by a tab and a weight")
   parser.add_argument("--outfile", "-o", nargs='?', type=argparse.FileType('w'), default=sys.stdout, help="output file")
   parser.add_argument("--default", default="pos", help="default category")
+  parser.add_argument("--lexicon-cache", default=None, help="file to keep the compiled pos and neg lexicons in, rebuilt when either changes")
+  parser.add_argument("--workers", "-w", type=int, default=1, help="classifier processes")
+  parser.add_argument("--chunk-size", type=int, default=10000, help="lines read, classified and written at a time")
+  addonoffarg(parser, 'corpus', help="the input is a binary token corpus written by tok.py or extract.py with --corpus", default=False)
+  parser.add_argument("--bench", type=int, default=0, help="instead of classifying the input, time this many synthetic reviews and write the results as json")
 
 
 
@@ -73,34 +252,21 @@ def main():
     atexit.register(cleanwork)
 
 
-  infile = prepfile(args.infile, 'r')
+  if args.corpus:
+    from tokcorpus import read_corpus
+    # lowercase each word once, as it enters the vocabulary, rather than every line
+    infile = read_corpus(prepfile(args.infile, 'rb'), normalize=lambda word: word.lower())
+  else:
+    infile = prepfile(args.infile, 'r')
   outfile = prepfile(args.outfile, 'w')
 
-  posfile = prepfile(args.posfile, 'r')
-  negfile = prepfile(args.negfile, 'r')
-
-  pos = set()
-  neg = set()
-  for line in posfile:
-    pos.add(line.strip())
-  for line in negfile:
-    neg.add(line.strip())
-
-  for line in infile:
-    poscount = 0
-    negcount = 0
-    for word in line.strip().split():
-      word = word.lower()
-      if word in pos:
-        poscount+=1
-      elif word in neg:
-        negcount+=1
-    if poscount > negcount:
-      outfile.write("pos\n")
-    elif negcount > poscount:
-      outfile.write("neg\n")
-    else:
-      outfile.write(args.default+"\n")
+  lexicon = load_lexicon(args.posfile, args.negfile, cache=args.lexicon_cache)
+
+  if args.bench:
+    outfile.write(json.dumps(benchmark(lexicon, args.bench, args.workers, args.chunk_size), indent=2, sort_keys=True)+"\n")
+    return
+  for block in classify(lexicon, infile, args.default, workers=args.workers, chunk_size=args.chunk_size, tokenized=args.corpus):
+    outfile.write(block)
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,233 @@
+import os
+import sys
+import time
+import pickle
+import shutil
+import tempfile
+import unittest
+import threading
+import subprocess
+import simplesent
+from simplesent import load_lexicon
+from tokcorpus import CorpusWriter, CorpusReader, read_corpus
+from pipeline import Pipeline, PipelineError, Stage, read_blocks
+from fileio import prepfile, READAHEAD, BUFSIZE
+from tok import tokenize
+from extract import review_text, stream_review_text, review_lines
+
+
+class TestSequenceFunctions(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.posfile = self.write("pos.txt", "good\ngreat\t2.5\nvery good\t3\n")
+        self.negfile = self.write("neg.txt", "bad\nawful\t4\ngood\n")
+        self.cache = os.path.join(self.workdir, "lexicon.cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def write(self, name, text):
+        path = os.path.join(self.workdir, name)
+        with open(path, 'w') as fh:
+            fh.write(text)
+        return path
+
+    def load(self):
+        with open(self.posfile) as posfile:
+            with open(self.negfile) as negfile:
+                return load_lexicon(posfile, negfile, cache=self.cache)
+
+    def recorded(self):
+        with open(self.cache, 'rb') as fh:
+            return pickle.load(fh)[0]
+
+    def test_weights(self):
+        lexicon = self.load()
+        # word<TAB>weight lines, signed by the list they are in; the positive list wins
+        self.assertEqual(lexicon.weights, {"good": 1, "great": 2.5, "very good": 3, "bad": -1, "awful": -4})
+        self.assertEqual(lexicon.score("a very good day".split()), 3)
+        self.assertEqual(lexicon.classify("Great but awful", "pos"), "neg")
+        self.assertEqual(lexicon.classify("nothing here", "pos"), "pos")
+
+    def test_cache_hit(self):
+        built = self.load()
+        self.assertTrue(os.path.exists(self.cache))
+        digest = simplesent._digest
+        # an untouched file is trusted on its mtime and size, without reading it
+        simplesent._digest = None
+        try:
+            self.assertEqual(self.load().weights, built.weights)
+        finally:
+            simplesent._digest = digest
+
+    def test_cache_touched(self):
+        built = self.load()
+        later = time.time() + 100
+        os.utime(self.posfile, (later, later))
+        self.assertEqual(self.load().weights, built.weights)
+        # the new mtime is recorded, so the file isn't hashed again next time
+        self.assertEqual(self.recorded()[0][1], os.stat(self.posfile).st_mtime)
+        digest = simplesent._digest
+        simplesent._digest = None
+        try:
+            self.assertEqual(self.load().weights, built.weights)
+        finally:
+            simplesent._digest = digest
+
+    def test_cache_edited(self):
+        self.load()
+        stat = os.stat(self.negfile)
+        # the same size as before, so only the hash tells them apart
+        self.write("neg.txt", "sad\nawful\t4\ngood\n")
+        os.utime(self.negfile, (stat.st_atime, stat.st_mtime + 1))
+        lexicon = self.load()
+        self.assertEqual(lexicon.weights.get("sad"), -1)
+        self.assertEqual(lexicon.weights.get("bad"), None)
+
+    def test_cache_unreadable(self):
+        with open(self.cache, 'wb') as fh:
+            fh.write(b"not a pickle")
+        self.assertEqual(self.load().weights["awful"], -4)
+        self.assertEqual([source[0] for source in self.recorded()],
+                         [os.path.abspath(self.posfile), os.path.abspath(self.negfile)])
+
+    LINES = [[u"the", u"cat", u"sat"], [], [u"caf\u00e9", u"the"], [u"sat", u"sat", u"sat", u"down"]]
+
+    def write_corpus(self, lines, bufsize=None):
+        path = os.path.join(self.workdir, "corpus.tok")
+        writer = CorpusWriter(open(path, 'wb'))
+        if bufsize is not None:
+            writer.BUFSIZE = bufsize
+        with writer:
+            for tokens in lines:
+                writer.write(tokens)
+        return path
+
+    def test_corpus_round_trip(self):
+        # a tiny buffer flushes after every line
+        for bufsize in (None, 1):
+            path = self.write_corpus(self.LINES, bufsize)
+            with open(path, 'rb') as fh:
+                self.assertEqual(list(read_corpus(fh)), self.LINES)
+            with open(path, 'rb') as fh:
+                self.assertEqual(list(read_corpus(fh, normalize=lambda word: word.upper()))[0], [u"THE", u"CAT", u"SAT"])
+
+    def test_corpus_random_access(self):
+        path = self.write_corpus(self.LINES)
+        reader = CorpusReader(path)
+        try:
+            self.assertEqual(len(reader), len(self.LINES))
+            self.assertEqual(reader.vocab, [u"the", u"cat", u"sat", u"caf\u00e9", u"down"])
+            for i in (3, 0, 2, 1):
+                self.assertEqual(reader[i], self.LINES[i])
+            self.assertEqual(list(reader.ids(3)), [2, 2, 2, 4])
+            self.assertEqual(list(reader), self.LINES)
+        finally:
+            reader.close()
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tokcorpus.py")
+        out = subprocess.check_output([sys.executable, script, "-i", path, "--start", "2", "--end", "9"])
+        self.assertEqual(out.decode('utf8'), u"caf\u00e9 the\nsat sat sat down\n")
+
+    def test_corpus_unfinished(self):
+        path = self.write_corpus(self.LINES)
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        # never closed, so no footer; footer cut short; too short to hold a trailer
+        unflushed = os.path.join(self.workdir, "unflushed.tok")
+        writer = CorpusWriter(open(unflushed, 'wb'))
+        for tokens in self.LINES:
+            writer.write(tokens)
+        writer.flush()
+        writer._fh.close()
+        for name, contents in (("truncated.tok", data[:-5]), ("tiny.tok", data[:3])):
+            with open(os.path.join(self.workdir, name), 'wb') as fh:
+                fh.write(contents)
+        for name in ("unflushed.tok", "truncated.tok", "tiny.tok"):
+            self.assertRaises(ValueError, CorpusReader, os.path.join(self.workdir, name))
+        # read front to back, the lines written before the footer are all there
+        with open(unflushed, 'rb') as fh:
+            self.assertEqual(list(read_corpus(fh)), self.LINES)
+
+    def test_pipeline_failure(self):
+        def halve(items):
+            for item in items:
+                yield 10 // item
+        def double(items):
+            for item in items:
+                yield 2 * item
+        for mode in ("inline", "thread", "process"):
+            pipeline = Pipeline([Stage("halve", halve), Stage("double", double)], mode=mode, batch_size=2)
+            self.assertEqual(list(pipeline.run(iter([1, 2, 5]))), [20, 10, 4])
+            self.assertEqual([stage["items_out"] for stage in pipeline.stats], [3, 3, 3])
+            pipeline = Pipeline([Stage("halve", halve), Stage("double", double)], mode=mode, batch_size=2)
+            try:
+                list(pipeline.run(iter([1, 0, 5])))
+                self.fail("a failing %s pipeline ran to the end" % mode)
+            except PipelineError as error:
+                self.assertTrue(str(error).startswith("stage halve failed:"), str(error))
+                self.assertTrue("ZeroDivisionError" in str(error))
+
+    def test_pipeline_compressed_source(self):
+        # more than the decompressing thread reads ahead, which a forked stage wouldn't get
+        path = os.path.join(self.workdir, "big.gz")
+        line = b"the quick brown fox jumps over the lazy dog %d\n"
+        size = 0
+        with prepfile(path, 'wb') as fh:
+            for i in range(3 * READAHEAD * BUFSIZE // len(line)):
+                fh.write(line % i)
+                size += len(line % i)
+        def count(blocks):
+            yield sum(len(block) for block in blocks)
+        for mode in ("inline", "thread", "process"):
+            pipeline = Pipeline([Stage("count", count)], mode=mode)
+            result = []
+            def run():
+                result.extend(pipeline.run(read_blocks(prepfile(path, 'rb'))))
+            runner = threading.Thread(target=run)
+            runner.daemon = True
+            runner.start()
+            runner.join(60)
+            self.assertFalse(runner.is_alive(), "a %s pipeline reading %s hung" % (mode, path))
+            self.assertEqual(result, [size])
+
+    def test_tokenize_pool(self):
+        lines = [u"Don't stop, I said.\n", u"\n", u"caf\u00e9 au lait (hot)\n"] + [u"line %d is here.\n" % i for i in range(10)]
+        serial = list(tokenize(iter(lines), workers=1, chunk_size=3))
+        pooled = list(tokenize(iter(lines), workers=2, chunk_size=3))
+        self.assertEqual(len(pooled), 5)
+        self.assertEqual(pooled, serial)
+        self.assertEqual(''.join(pooled).split("\n")[:3], [u"Do n't stop , I said .", u"", u"caf\u00e9 au lait ( hot )"])
+        serial = list(tokenize(iter(lines), workers=1, chunk_size=3, join=False))
+        pooled = list(tokenize(iter(lines), workers=2, chunk_size=3, join=False))
+        self.assertEqual(pooled, serial)
+        self.assertEqual([tokens for block in pooled for tokens in block][12], [u"line", u"9", u"is", u"here", u"."])
+
+    REVIEWS = (u"<review>\n<title>\nNot this &amp; not that\n</title>\n<review_text>\nCaf\u00e9 &amp; cr\u00e8me &lt;3 &#233;t\u00e9 &#x263A;\n"
+               u"\nsecond line\n</review_text>\n<rating>\n5.0\n</rating>\n</review>\n"
+               u"<review>\n<review_text>\n\u2603 \"snow\" r&eacute;sum&eacute;\n</review_text>\n</review>\n").encode('utf8')
+    TEXTS = [u"\nCaf\u00e9 & cr\u00e8me <3 \u00e9t\u00e9 \u263a\n\nsecond line\n", u"\n\u2603 \"snow\" r\u00e9sum\u00e9\n"]
+
+    def test_review_text(self):
+        self.assertEqual(list(review_text([self.REVIEWS])), self.TEXTS)
+        # every split point, which lands inside tags, entities and multibyte characters
+        for size in (1, 2, 3, 7):
+            blocks = [self.REVIEWS[i:i + size] for i in range(0, len(self.REVIEWS), size)]
+            self.assertEqual(list(review_text(blocks)), self.TEXTS)
+        for i in range(len(self.REVIEWS)):
+            self.assertEqual(list(review_text([self.REVIEWS[:i], self.REVIEWS[i:]])), self.TEXTS)
+        path = os.path.join(self.workdir, "reviews")
+        with open(path, 'wb') as fh:
+            fh.write(self.REVIEWS)
+        with open(path, 'rb') as fh:
+            self.assertEqual(list(stream_review_text(fh, blocksize=5)), self.TEXTS)
+        # each review is yielded as soon as it closes, before the rest is read
+        texts = review_text(iter([self.REVIEWS[:self.REVIEWS.index(b"<rating>")], None]))
+        self.assertEqual(next(texts), self.TEXTS[0])
+
+    def test_review_lines(self):
+        self.assertEqual(list(review_lines(self.TEXTS + [u"", u"\n\n"])),
+                         [u"Caf\u00e9 & cr\u00e8me <3 \u00e9t\u00e9 \u263a", u"second line", u"\u2603 \"snow\" r\u00e9sum\u00e9"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,6 @@
 # tokenize with nltk
 import argparse
 import sys
-import codecs
 if sys.version_info[0] == 2:
   from itertools import izip
 else:
@@ -10,32 +9,16 @@ else:
 from collections import defaultdict as dd
 import re
 import os.path
-import gzip
 import tempfile
 import shutil
 import atexit
-import nltk
-
-scriptdir = os.path.dirname(os.path.abspath(__file__))
 
+from fileio import prepfile
+from chunkpool import chunked, map_chunks
 
-reader = codecs.getreader('utf8')
-writer = codecs.getwriter('utf8')
 
+scriptdir = os.path.dirname(os.path.abspath(__file__))
 
-def prepfile(fh, code):
-  if type(fh) is str:
-    fh = open(fh, code)
-  ret = gzip.open(fh.name, code if code.endswith("t") else code+"t") if fh.name.endswith(".gz") else fh
-  if sys.version_info[0] == 2:
-    if code.startswith('r'):
-      ret = reader(fh)
-    elif code.startswith('w'):
-      ret = writer(fh)
-    else:
-      sys.stderr.write("I didn't understand code "+code+"\n")
-      sys.exit(1)
-  return ret
 
 def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
   ''' add the switches --arg and --no-arg that set parser.arg to true/false, respectively'''
@@ -44,12 +27,30 @@ def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
   group.add_argument('--%s' % arg, dest=dest, action='store_true', default=default, help=help)
   group.add_argument('--no-%s' % arg, dest=dest, action='store_false', default=default, help="See --%s" % arg)
 
+def tokenize_chunk(lines, join=True):
+  ''' tokenize each of lines, returning the results as one block of text, a line per input line, or if not join as a list of token lists'''
+  from nltk import word_tokenize
+  tokens = [word_tokenize(line.strip()) for line in lines]
+  if not join:
+    return tokens
+  return ''.join([' '.join(line)+"\n" for line in tokens])
+
+def tokenize(infile, workers=1, chunk_size=10000, join=True):
+  ''' yield blocks of tokenized text (or token lists, if not join) for infile in order, tokenizing chunk_size lines at a time in a pool of workers processes'''
+  if workers > 1:
+    # import nltk before forking so the workers don't each have to
+    import nltk
+  return map_chunks(tokenize_chunk, chunked(infile, chunk_size), (join,), workers)
+
 def main():
-  parser = argparse.ArgumentParser(description="REPLACE WITH DESCRIPTION",
+  parser = argparse.ArgumentParser(description="tokenize each line of the input with nltk's word_tokenize",
                                    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
   addonoffarg(parser, 'debug', help="debug mode", default=False)
   parser.add_argument("--infile", "-i", nargs='?', type=argparse.FileType('r'), default=sys.stdin, help="input file")
   parser.add_argument("--outfile", "-o", nargs='?', type=argparse.FileType('w'), default=sys.stdout, help="output file")
+  parser.add_argument("--workers", "-w", type=int, default=1, help="tokenizer processes")
+  parser.add_argument("--chunk-size", type=int, default=10000, help="lines read, tokenized and written at a time")
+  addonoffarg(parser, 'corpus', help="write a binary token corpus (see tokcorpus.py) for simplesent.py --corpus instead of text", default=False)
 
 
 
@@ -70,11 +71,17 @@ def main():
 
 
   infile = prepfile(args.infile, 'r')
-  outfile = prepfile(args.outfile, 'w')
-
 
-  for line in infile:
-    outfile.write(' '.join(nltk.word_tokenize(line.strip()))+"\n")
+  if args.corpus:
+    from tokcorpus import CorpusWriter
+    with CorpusWriter(prepfile(args.outfile, 'wb')) as corpus:
+      for block in tokenize(infile, workers=args.workers, chunk_size=args.chunk_size, join=False):
+        for tokens in block:
+          corpus.write(tokens)
+    return
+  outfile = prepfile(args.outfile, 'w')
+  for block in tokenize(infile, workers=args.workers, chunk_size=args.chunk_size):
+    outfile.write(block)
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# binary tokenized-corpus format passed between extract.py, tok.py and simplesent.py
+import argparse
+import sys
+if sys.version_info[0] == 2:
+  from itertools import izip
+else:
+  izip = zip
+import os.path
+import mmap
+import struct
+from array import array
+
+from fileio import prepfile
+
+
+scriptdir = os.path.dirname(os.path.abspath(__file__))
+
+# A corpus is a stream of records, each a one-byte tag and a uint32 count:
+#   V n <n bytes>      the utf8 spelling of the next vocabulary id (ids count up from 0)
+#   L n <n uint32 ids> one line of n tokens
+# A word's V record always comes before the first line that uses it, so the
+# stream can be read front to back, e.g. from a pipe. Closing a writer appends
+#   F <uint64 vocabulary size> <uint64 line count>
+#     <vocabulary size + 1 uint64 offsets into the blob> <utf8 blob of all words>
+#     <line count uint64 offsets of the lines' L records>
+#   <uint64 offset of the F record> MAGIC
+# so a finished file can be memory-mapped and its lines read in any order.
+# All numbers are little-endian.
+MAGIC = b'TOKCRP01'
+RECORD = struct.Struct('<cI')
+COUNTS = struct.Struct('<QQ')
+TRAILER = struct.Struct('<Q8s')
+_LITTLE = sys.byteorder == 'little'
+try:
+  array('Q')
+  _WIDE = True
+except ValueError:
+  # python 2's arrays have no 64-bit type; those numbers go through struct instead
+  _WIDE = False
+
+def _pack(code, values):
+  if code == 'Q' and not _WIDE:
+    return struct.pack('<%dQ' % len(values), *values)
+  values = array(code, values)
+  if not _LITTLE:
+    values.byteswap()
+  return values.tobytes() if hasattr(values, 'tobytes') else values.tostring()
+
+def _unpack(code, buf):
+  if code == 'Q' and not _WIDE:
+    buf = buf.tobytes() if isinstance(buf, memoryview) else buf
+    return struct.unpack('<%dQ' % (len(buf) // 8), buf)
+  values = array(code)
+  values.frombytes(buf) if hasattr(values, 'frombytes') else values.fromstring(buf.tobytes() if isinstance(buf, memoryview) else buf)
+  if not _LITTLE:
+    values.byteswap()
+  return values
+
+
+class CorpusWriter(object):
+  """
+  Writes lines of tokens to the binary file fh as a corpus, numbering words
+  as they first appear. Output is gathered into blocks of about BUFSIZE
+  bytes before it is written.
+  """
+
+  BUFSIZE = 1 << 20
+
+  def __init__(self, fh):
+    self._fh = fh
+    self._vocab = {}
+    self._words = []
+    self._lines = array('Q') if _WIDE else []
+    self._buffer = bytearray()
+    self._written = 0
+
+  def write(self, tokens):
+    """
+    Append a line made of tokens, a list of strings.
+    """
+    vocab = self._vocab
+    buf = self._buffer
+    ids = []
+    for token in tokens:
+      i = vocab.get(token)
+      if i is None:
+        i = vocab[token] = len(self._words)
+        self._words.append(token)
+        spelling = token.encode('utf8')
+        buf += RECORD.pack(b'V', len(spelling))
+        buf += spelling
+      ids.append(i)
+    self._lines.append(self._written + len(buf))
+    buf += RECORD.pack(b'L', len(ids))
+    buf += _pack('I', ids)
+    if len(buf) >= self.BUFSIZE:
+      self.flush()
+
+  def flush(self):
+    self._fh.write(bytes(self._buffer))
+    self._written += len(self._buffer)
+    del self._buffer[:]
+
+  def close(self):
+    """
+    Write the footer that allows random access, and close fh.
+    """
+    self.flush()
+    start = self._written
+    spellings = [word.encode('utf8') for word in self._words]
+    offsets = [0]
+    for spelling in spellings:
+      offsets.append(offsets[-1] + len(spelling))
+    self._fh.write(b''.join([b'F', COUNTS.pack(len(spellings), len(self._lines)),
+                             _pack('Q', offsets), b''.join(spellings), _pack('Q', self._lines),
+                             TRAILER.pack(start, MAGIC)]))
+    self._fh.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+
+def read_corpus(fh, normalize=None):
+  """
+  Lazily yield the lines of the corpus in the binary file fh, front to back,
+  as lists of words. If normalize is given, each vocabulary word is passed
+  through it once, when it is defined, rather than at every use.
+  """
+  vocab = []
+  word = vocab.__getitem__
+  read = fh.read
+  while True:
+    head = read(RECORD.size)
+    if len(head) < RECORD.size:
+      break
+    tag, count = RECORD.unpack(head)
+    if tag == b'L':
+      yield list(map(word, _unpack('I', read(4 * count))))
+    elif tag == b'V':
+      spelling = read(count).decode('utf8')
+      vocab.append(normalize(spelling) if normalize is not None else spelling)
+    else:
+      # the footer, which the records have already told us everything in
+      break
+
+
+class CorpusReader(object):
+  """
+  Random access to a finished corpus file at path, memory-mapped: len() is
+  its number of lines, reader[i] is line i as a list of words, and ids(i)
+  is line i's vocabulary ids, read straight out of the mapping.
+  """
+
+  def __init__(self, path):
+    with open(path, 'rb') as fh:
+      self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      buf = self._buf = memoryview(self._map)
+    except TypeError:
+      # python 2's mmap can't be viewed, only copied
+      buf = self._buf = memoryview(self._map[:])
+    start, magic = TRAILER.unpack(buf[len(buf) - TRAILER.size:].tobytes()) if len(buf) >= TRAILER.size else (0, None)
+    if magic != MAGIC or buf[start:start + 1].tobytes() != b'F':
+      raise ValueError("%s is not a finished token corpus" % path)
+    nwords, nlines = COUNTS.unpack(buf[start + 1:start + 1 + COUNTS.size].tobytes())
+    pos = start + 1 + COUNTS.size
+    offsets = _unpack('Q', buf[pos:pos + 8 * (nwords + 1)])
+    pos += 8 * (nwords + 1)
+    blob = buf[pos:pos + offsets[-1]].tobytes()
+    self.vocab = [blob[offsets[i]:offsets[i + 1]].decode('utf8') for i in range(nwords)]
+    pos += offsets[-1]
+    self._lines = _unpack('Q', buf[pos:pos + 8 * nlines])
+
+  def __len__(self):
+    return len(self._lines)
+
+  def ids(self, i):
+    """
+    Return the vocabulary ids of line i, as a memoryview into the file on
+    little-endian machines and as an array elsewhere.
+    """
+    pos = self._lines[i]
+    count = RECORD.unpack(self._buf[pos:pos + RECORD.size].tobytes())[1]
+    ids = self._buf[pos + RECORD.size:pos + RECORD.size + 4 * count]
+    return ids.cast('I') if _LITTLE and hasattr(ids, 'cast') else _unpack('I', ids)
+
+  def __getitem__(self, i):
+    return list(map(self.vocab.__getitem__, self.ids(i)))
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def close(self):
+    if hasattr(self._buf, 'release'):
+      self._buf.release()
+    self._map.close()
+
+
+def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
+  ''' add the switches --arg and --no-arg that set parser.arg to true/false, respectively'''
+  group = parser.add_mutually_exclusive_group()
+  dest = arg if dest is None else dest
+  group.add_argument('--%s' % arg, dest=dest, action='store_true', default=default, help=help)
+  group.add_argument('--no-%s' % arg, dest=dest, action='store_false', default=default, help="See --%s" % arg)
+
+def main():
+  parser = argparse.ArgumentParser(description="print the lines of a token corpus written with --corpus as space-separated text",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  addonoffarg(parser, 'debug', help="debug mode", default=False)
+  parser.add_argument("--infile", "-i", nargs='?', type=argparse.FileType('rb'), default=sys.stdin, help="input corpus")
+  parser.add_argument("--outfile", "-o", nargs='?', type=argparse.FileType('w'), default=sys.stdout, help="output file")
+  parser.add_argument("--start", type=int, default=0, help="first line to print (needs a finished corpus file)")
+  parser.add_argument("--end", type=int, default=None, help="line to stop before (needs a finished corpus file)")
+
+  try:
+    args = parser.parse_args()
+  except IOError as msg:
+    parser.error(str(msg))
+
+  outfile = prepfile(args.outfile, 'w')
+  if args.start or args.end is not None:
+    try:
+      reader = CorpusReader(args.infile.name)
+    except (ValueError, EnvironmentError) as msg:
+      parser.error("can't read lines out of order from %s: %s" % (args.infile.name, msg))
+    end = len(reader) if args.end is None else min(args.end, len(reader))
+    for i in range(args.start, end):
+      outfile.write(' '.join(reader[i])+"\n")
+    return
+  for tokens in read_corpus(prepfile(args.infile, 'rb')):
+    outfile.write(' '.join(tokens)+"\n")
+
+if __name__ == '__main__':
+  main()